@@ -1,14 +1,20 @@
 import os
 import json
-import threading
 import uuid
 import sys
-import subprocess
-from queue import Queue
+import threading
+import contextvars
+import time
+from collections import deque
+from typing import List
+from concurrent.futures import ThreadPoolExecutor
 from flask import Flask, request, jsonify, send_from_directory, send_file, abort
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 
+from pipeline import run_pipeline
+from redis_jobs import HAS_REDIS, REDIS_URL, RedisJobStore
+
 # Initialize Flask app
 app = Flask(__name__, static_folder='static')
 
@@ -17,60 +23,146 @@ CORS(app)
 # In-memory job storage
 jobs = {}
 
+# With REDIS_URL set, job state lives in Redis and pipelines run on RQ workers
+# (`rq worker pipeline`), so several web processes can serve the same jobs
+redis_store = None
+if REDIS_URL:
+    if HAS_REDIS:
+        redis_store = RedisJobStore(REDIS_URL)
+    else:
+        print("REDIS_URL is set but redis/rq are not installed; keeping jobs in memory")
+
+# Bounded worker pool so concurrent uploads queue instead of thrashing Ollama
+MAX_CONCURRENT_JOBS = int(os.environ.get('MAX_CONCURRENT_JOBS', 2))
+executor = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_JOBS)
+
+class LogBuffer:
+    """
+    Per-job log buffer. deque append/popleft are atomic, so the pipeline
+    reader never takes a lock; an Event wakes the SSE stream when lines arrive.
+    """
+    def __init__(self, maxlen: int = 10000):
+        self._lines = deque(maxlen=maxlen)
+        self._ready = threading.Event()
+
+    def put(self, line: str):
+        self._lines.append(line)
+        self._ready.set()
+
+    def get(self) -> str:
+        while True:
+            # Clear before checking so a put() racing with us still wakes the wait
+            self._ready.clear()
+            try:
+                return self._lines.popleft()
+            except IndexError:
+                self._ready.wait()
+
+    def get_batch(self, max_lines: int = 500, window: float = 0.05) -> List[str]:
+        """Block for one line, then coalesce whatever arrives within `window` seconds."""
+        lines = [self.get()]
+        time.sleep(window)
+        while len(lines) < max_lines:
+            try:
+                lines.append(self._lines.popleft())
+            except IndexError:
+                break
+        return lines
+
+class _JobLog:
+    """Assembles one job's printed text into lines for its LogBuffer."""
+    def __init__(self, buffer: LogBuffer):
+        self.buffer = buffer
+        self.pending = ''
+        self.lock = threading.Lock()
+
+    def write(self, text: str):
+        with self.lock:
+            *lines, self.pending = (self.pending + text).split('\n')
+        for line in lines:
+            self.buffer.put(line.strip())
+
+    def close(self):
+        with self.lock:
+            if self.pending.strip():
+                self.buffer.put(self.pending.strip())
+            self.pending = ''
+
+class ThreadStdout:
+    """
+    sys.stdout wrapper that sends print() output from a job to that job's
+    LogBuffer, line by line; other threads write through unchanged. The target
+    is held in a ContextVar, so prints from the pipeline's asyncio.to_thread
+    workers follow the job that started them.
+    """
+    def __init__(self, stream):
+        self._stream = stream
+        self._job = contextvars.ContextVar('job_log', default=None)
+
+    def attach(self, buffer: LogBuffer):
+        self._job.set(_JobLog(buffer))
+
+    def detach(self):
+        job_log = self._job.get()
+        if job_log is not None:
+            job_log.close()
+        self._job.set(None)
+
+    def write(self, text: str) -> int:
+        job_log = self._job.get()
+        if job_log is None:
+            return self._stream.write(text)
+        job_log.write(text)
+        return len(text)
+
+    def flush(self):
+        if self._job.get() is None:
+            self._stream.flush()
+
+    def __getattr__(self, name):
+        return getattr(self._stream, name)
+
+job_stdout = ThreadStdout(sys.stdout)
+sys.stdout = job_stdout
+
 class Job:
     def __init__(self, pdf_path: str, pages: int):
         self.id = str(uuid.uuid4())
         self.pdf_path = pdf_path
         self.pages = pages
         self.status = 'pending'
-        self.log_queue = Queue()
+        self.log_buffer = LogBuffer()
         self.result = {}
 
     def run(self):
         # Mark as running and log start
         self.status = 'running'
         filename = os.path.basename(self.pdf_path)
-        self.log_queue.put(f"Processing PDF: {filename}")
-
-        # Prepare environment to preserve UTF-8
-        env = os.environ.copy()
-        env['PYTHONIOENCODING'] = 'utf-8'
-
-        # Build command using same Python interpreter
-        cmd = [
-            sys.executable,
-            os.path.join(os.getcwd(), 'pipeline.py'),
-            '--input-pdf', self.pdf_path,
-            '--pages', str(self.pages)
-        ]
-
-        # Launch subprocess
-        proc = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            encoding='utf-8',
-            errors='replace',
-            cwd=os.getcwd(),
-            env=env
-        )
-
-        # Stream logs from subprocess
-        for line in proc.stdout:
-            self.log_queue.put(line.strip())
-        proc.wait()
+        self.log_buffer.put(f"Processing PDF: {filename}")
+
+        # Run the pipeline in-process: modules and the HTTP session to Ollama
+        # stay loaded across jobs. Prints from the pipeline steps started by
+        # this job are routed into its log.
+        job_stdout.attach(self.log_buffer)
+        try:
+            outputs = run_pipeline(self.pdf_path, self.pages, log=self.log_buffer.put)
+            ok = True
+        except Exception as e:
+            self.log_buffer.put(f"Error: {e}")
+            ok = False
+        finally:
+            job_stdout.detach()
 
         # Prepare result filenames (no directories)
-        base_name = os.path.splitext(os.path.basename(self.pdf_path))[0]
-        self.result = {
-            'narrative': f"{base_name}_narrative.txt",
-            'sankey':    f"{base_name}_sankey.html"
-        }
+        if ok:
+            self.result = {
+                'narrative': os.path.basename(outputs['narrative']),
+                'sankey':    os.path.basename(outputs['sankey'])
+            }
 
         # Final log and status
-        self.log_queue.put('Pipeline complete!')
-        self.status = 'completed' if proc.returncode == 0 else 'failed'
+        self.log_buffer.put('Pipeline complete!')
+        self.status = 'completed' if ok else 'failed'
 
 @app.route('/')
 def index():
@@ -94,13 +186,20 @@ def upload_pdf():
     file.save(pdf_path)
 
     # Start job
+    if redis_store:
+        return jsonify({'job_id': redis_store.enqueue(pdf_path, pages)})
     job = Job(pdf_path=pdf_path, pages=pages)
     jobs[job.id] = job
-    threading.Thread(target=job.run, daemon=True).start()
+    executor.submit(job.run)
     return jsonify({'job_id': job.id})
 
 @app.route('/api/status/<job_id>')
 def status(job_id):
+    if redis_store:
+        job_status = redis_store.status(job_id)
+        if not job_status:
+            return jsonify({'status': 'unknown'}), 404
+        return jsonify({'status': job_status})
     job = jobs.get(job_id)
     if not job:
         return jsonify({'status': 'unknown'}), 404
@@ -108,19 +207,32 @@ def status(job_id):
 
 @app.route('/api/logs/<job_id>')
 def logs(job_id):
-    job = jobs.get(job_id)
-    if not job:
-        return abort(404)
+    if redis_store:
+        if not redis_store.exists(job_id):
+            return abort(404)
+        batches = redis_store.log_batches(job_id)
+    else:
+        job = jobs.get(job_id)
+        if not job:
+            return abort(404)
+        batches = iter(job.log_buffer.get_batch, None)
     def stream():
-        while True:
-            line = job.log_queue.get()
-            yield f"data: {line}\n\n"
-            if line.strip().endswith('Pipeline complete!'):
+        for lines in batches:
+            # One SSE event per batch; each line is its own data: field
+            yield ''.join(f"data: {line}\n" for line in lines) + "\n"
+            if any(line.strip().endswith('Pipeline complete!') for line in lines):
                 break
     return app.response_class(stream(), mimetype='text/event-stream')
 
 @app.route('/api/results/<job_id>')
 def results(job_id):
+    if redis_store:
+        job_status = redis_store.status(job_id)
+        if not job_status:
+            return jsonify({'error': 'Job not found'}), 404
+        if job_status != 'completed':
+            return jsonify({'status': job_status}), 400
+        return jsonify(redis_store.result(job_id))
     job = jobs.get(job_id)
     if not job:
         return jsonify({'error': 'Job not found'}), 404
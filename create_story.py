@@ -1,18 +1,84 @@
 import os
 import json
 import re
+import time
+import hashlib
+import tempfile
 import argparse
-from typing import Optional, Tuple
+from typing import Optional, Tuple, List
 
-from generate_financial_summary import generate_financial_summary, call_ollama
+from generate_financial_summary import generate_financial_summary
 from grade_narrative import grade_narrative
+import ollama_client
+from ollama_client import call_ollama, set_cache_enabled, write_json, SHARED_PREAMBLE
+
+# Parsed (score, feedback) per summary + grade model, so re-runs that only
+# change the refine step skip the grader; entries expire like the Ollama
+# response cache (OLLAMA_CACHE_TTL)
+GRADE_CACHE_DIR = os.environ.get("GRADE_CACHE_DIR", ".grade_cache")
+
+# Precompiled markdown emphasis patterns
+_BOLD_RE = re.compile(r'\*\*(.*?)\*\*')
+_ITAL_RE = re.compile(r'\*(.*?)\*')
 
 def strip_markdown(text: str) -> str:
     # remove **bold**, *italic*, and backticks
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-    text = re.sub(r'\*(.*?)\*',    r'\1', text)
+    text = _BOLD_RE.sub(r'\1', text)
+    text = _ITAL_RE.sub(r'\1', text)
     return text.replace('`', '')
 
+# Static parts of the refine prompt, built once at import; the summary and
+# feedback are the only per-call text
+_REFINE_PROMPT_PREFIX = (
+    SHARED_PREAMBLE +
+    "You are a skilled financial journalist tasked with transforming a factual financial summary into an engaging narrative report. "
+    "Your goal is to convert bullet-point facts into a compelling story that maintains complete accuracy while being more readable and engaging.\n\n"
+
+    "# INSTRUCTIONS\n"
+    "1. Convert the bullet-point format into flowing paragraphs with a cohesive narrative structure\n"
+    "2. Maintain ALL factual information - every number and data point must be preserved exactly\n"
+    "3. Group related information into logical sections with clear headings\n"
+    "4. Add appropriate transitions between sections and ideas\n"
+    "5. Use a professional, authoritative tone suitable for investors and financial professionals\n"
+    "6. Include a brief executive summary at the beginning highlighting key points\n"
+    "7. Address all feedback points provided below\n\n"
+
+    "# FACTUAL SUMMARY\n"
+)
+_REFINE_PROMPT_FEEDBACK = "\n\n# FEEDBACK TO ADDRESS\n"
+_REFINE_PROMPT_SUFFIX = (
+    "\n\n"
+    "# OUTPUT FORMAT\n"
+    "Create a well-structured narrative with clear sections, engaging transitions, and a compelling flow. "
+    "Use paragraph breaks appropriately. Include an executive summary followed by detailed sections that "
+    "present the information in a logical order.\n\n"
+
+    "BEGIN YOUR NARRATIVE REPORT:"
+)
+
+def _grade_cache_path(summary_content: str, grade_model: str) -> str:
+    key = hashlib.sha256((summary_content + grade_model).encode('utf-8')).hexdigest()
+    return os.path.join(GRADE_CACHE_DIR, f"{key}.json")
+
+def _load_cached_grade(path: str) -> Optional[Tuple[int, List[str]]]:
+    try:
+        ttl = ollama_client.CACHE_TTL
+        if ttl and time.time() - os.path.getmtime(path) > ttl:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return int(data["score"]), list(data["feedback"])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+def _store_cached_grade(path: str, score: int, feedback: List[str]) -> None:
+    os.makedirs(GRADE_CACHE_DIR, exist_ok=True)
+    # Unique temp name: concurrent jobs in one process may grade the same summary
+    fd, tmp = tempfile.mkstemp(dir=GRADE_CACHE_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({"score": score, "feedback": feedback}, f)
+    os.replace(tmp, path)
+
 def create_narrative(
     cleaned_txt: str,
     pages: int = 3,
@@ -36,7 +102,7 @@ def create_narrative(
 
     # Step 1: generate financial summary
     print("▶ Generating financial summary...")
-    generate_financial_summary(
+    summary_content, _ = generate_financial_summary(
         input_txt=cleaned_txt,
         output_txt=summary_txt,
         pages=pages,
@@ -45,13 +111,22 @@ def create_narrative(
 
     # Step 2: grade the summary
     print("▶ Grading financial summary...")
-    score, feedback = grade_narrative(
-        narrative_path=summary_txt,
-        model=grade_model
-    )
+    grade_cache = _grade_cache_path(summary_content, grade_model)
+    cached_grade = _load_cached_grade(grade_cache) if ollama_client.CACHE_ENABLED else None
+    if cached_grade is not None:
+        score, feedback = cached_grade
+        print("✅ Summary unchanged, reusing cached grade")
+    else:
+        score, feedback = grade_narrative(
+            narrative_path=summary_txt,
+            model=grade_model,
+            narrative_text=summary_content
+        )
+        if ollama_client.CACHE_ENABLED:
+            _store_cached_grade(grade_cache, score, feedback)
     # Write grading JSON to file
-    with open(grade_json, 'w', encoding='utf-8') as gf:
-        json.dump({"score": score, "feedback": feedback}, gf, indent=2)
+    grade = {"score": score, "feedback": feedback}
+    write_json(grade_json, grade)
     print(f"✅ Grading results saved to: {grade_json}")
 
     # Build feedback text for the refinement prompt
@@ -59,32 +134,11 @@ def create_narrative(
 
     # Step 3: refine into narrative
     print("▶ Creating narrative from summary...")
-    with open(summary_txt, 'r', encoding='utf-8') as f:
-        summary_content = f.read().strip()
+    summary_content = summary_content.strip()
 
     refine_prompt = (
-        "You are a skilled financial journalist tasked with transforming a factual financial summary into an engaging narrative report. "
-        "Your goal is to convert bullet-point facts into a compelling story that maintains complete accuracy while being more readable and engaging.\n\n"
-        
-        "# INSTRUCTIONS\n"
-        "1. Convert the bullet-point format into flowing paragraphs with a cohesive narrative structure\n"
-        "2. Maintain ALL factual information - every number and data point must be preserved exactly\n"
-        "3. Group related information into logical sections with clear headings\n"
-        "4. Add appropriate transitions between sections and ideas\n"
-        "5. Use a professional, authoritative tone suitable for investors and financial professionals\n"
-        "6. Include a brief executive summary at the beginning highlighting key points\n"
-        "7. Address all feedback points provided below\n\n"
-        
-        f"# FACTUAL SUMMARY\n{summary_content}\n\n"
-        
-        f"# FEEDBACK TO ADDRESS\n{feedback_text}\n\n"
-        
-        "# OUTPUT FORMAT\n"
-        "Create a well-structured narrative with clear sections, engaging transitions, and a compelling flow. "
-        "Use paragraph breaks appropriately. Include an executive summary followed by detailed sections that "
-        "present the information in a logical order.\n\n"
-        
-        "BEGIN YOUR NARRATIVE REPORT:"
+        _REFINE_PROMPT_PREFIX + summary_content +
+        _REFINE_PROMPT_FEEDBACK + feedback_text + _REFINE_PROMPT_SUFFIX
     )
     
     # raw LLM output (may contain **bold**, etc.)
@@ -128,8 +182,15 @@ def main():
         "--output-refined", "-o2",
         help="Custom path for refined narrative"
     )
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="Always call the model instead of reusing cached responses"
+    )
     args = parser.parse_args()
 
+    if args.no_cache:
+        set_cache_enabled(False)
+
     init, refined = create_narrative(
         cleaned_txt=args.cleaned,
         pages=args.pages,
@@ -1,30 +1,178 @@
 import os
 import json
 import argparse
-import subprocess
 import re
 from typing import List, Dict, Any, Optional
 
-def strip_markdown(text: str) -> str:
-    # remove **bold** and *italic*
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
-    text = re.sub(r'\*(.*?)\*', r'\1', text)
-    # remove any inline code ticks
-    return text.replace('`', '')
-
-def call_ollama(prompt: str, model: str = "gemma3:4b") -> str:
-    cmd = ["ollama", "run", model]
-    result = subprocess.run(
-        cmd,
-        input=prompt,
-        capture_output=True,
-        text=True,
-        encoding='utf-8',
-        errors='replace'
-    )
-    if result.returncode != 0:
-        raise RuntimeError(f"Ollama call failed: {result.stderr}")
-    return result.stdout.strip()
+from pydantic import BaseModel, TypeAdapter, ValidationError, field_validator
+
+from ollama_client import call_ollama, write_json, SHARED_PREAMBLE
+
+# The regex fallback only runs when explicitly enabled (REGEX_FALLBACK=1);
+# JSON mode at temperature 0 makes it unnecessary in the normal case
+REGEX_FALLBACK = os.environ.get("REGEX_FALLBACK", "0") == "1"
+
+# Label patterns per bucket for the regex fallback; each is followed by _VALUE_TAIL
+BUCKET_LABELS = {
+    "Products": [r"Products(?:\s+revenue)?", r"Product\s+sales"],
+    "Services": [r"Services(?:\s+revenue)?", r"Service\s+revenue"],
+    "Revenue": [r"(?:Total\s+)?Revenue", r"Net\s+sales"],
+    "Cost of Revenue": [r"Cost\s+of\s+(?:Revenue|Sales)", r"COGS"],
+    "Gross Profit": [r"Gross\s+Profit", r"Gross\s+Margin"],
+    "Operating Expenses": [r"Operating\s+Expenses", r"(?:Total\s+)?OPEX"],
+    "Operating Income": [
+        r"Operating\s+Income",
+        r"Income\s+from\s+operations",
+        r"Operating\s+(?:profit|earnings)"
+    ],
+    "Interest Expense": [r"Interest\s+Expense", r"Interest\s+expenses"],
+    "Interest Income": [r"Interest\s+Income", r"Interest\s+earned"],
+    "Other Income/Expense": [r"Other\s+Income(?:/Expense)?", r"Other\s+income\s+and\s+expense"],
+    "Taxes": [r"(?:Income\s+)?Tax(?:es)?(?:\s+Expense)?", r"Provision\s+for\s+(?:income\s+)?taxes"],
+    "Net Income": [r"Net\s+Income", r"Net\s+Earnings", r"Net\s+Profit"],
+}
+
+class Bucket(BaseModel):
+    bucket: str
+    value: float
+
+    @field_validator('value', mode='before')
+    @classmethod
+    def _strip_number_formatting(cls, v):
+        # Accept "1,234.5" / "$1,234.5" strings from the model
+        if isinstance(v, str):
+            return v.replace(',', '').replace('$', '').strip()
+        return v
+
+
+class ExtractionResult(BaseModel):
+    buckets: List[Bucket] = []
+    breakdown: Dict[str, float] = {}
+
+
+_RESULT_ADAPTER = TypeAdapter(ExtractionResult)
+
+# JSON schema for the structured-output extraction request
+EXTRACTION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "buckets": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "bucket": {"type": "string", "enum": list(BUCKET_LABELS)},
+                    "value": {"type": "number"}
+                },
+                "required": ["bucket", "value"]
+            }
+        },
+        "breakdown": {
+            "type": "object",
+            "properties": {
+                "Products": {"type": "number"},
+                "Services": {"type": "number"}
+            },
+            "required": ["Products", "Services"]
+        }
+    },
+    "required": ["buckets", "breakdown"]
+}
+
+# Amount following a label, with optional unit: groups are (number, unit)
+_VALUE_TAIL = r"[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?"
+
+# Expanded unit detection
+UNIT_MULTIPLIER = {
+    "million": 1.0, "m": 1.0, "M": 1.0,
+    "billion": 1000.0, "b": 1000.0, "B": 1000.0
+}
+
+# Precompile regexes for performance: one named group per bucket so a single
+# finditer pass dispatches on m.lastgroup, plus per-bucket patterns for misses
+_BUCKET_SLUGS = {re.sub(r"\W+", "_", b).strip("_").lower(): b for b in BUCKET_LABELS}
+_BUCKET_RE = re.compile(
+    "|".join(
+        f"(?P<{slug}>(?:{'|'.join(BUCKET_LABELS[b])}){_VALUE_TAIL})"
+        for slug, b in _BUCKET_SLUGS.items()
+    ),
+    re.IGNORECASE
+)
+_BUCKET_PATTERN_RES = {
+    b: re.compile(f"(?:{'|'.join(labels)}){_VALUE_TAIL}", re.IGNORECASE)
+    for b, labels in BUCKET_LABELS.items()
+}
+
+
+# Extraction instructions sent as the system message, like the grading rubric,
+# so every stage shares the SHARED_PREAMBLE prefix in the server's KV cache;
+# only the summary text in the user message varies per call
+_EXTRACT_SYSTEM_PROMPT = (
+    SHARED_PREAMBLE +
+    "# Financial Data Extraction Task\n\n"
+    "You are a financial analyst specializing in SEC filings and corporate financial statements. "
+    "I need your expertise to extract precise financial data from the text you are given, which comes from "
+    "a company's annual report (10-K filing).\n\n"
+
+    "## Instructions\n"
+    "1. Carefully analyze the financial summary to locate the following annual line items\n"
+    "2. Extract the *exact numerical values* as they appear in the text\n"
+    "3. Convert all values to millions of dollars for consistency\n"
+    "4. Pay special attention to units (million vs. billion) and adjust accordingly\n"
+    "5. For any value not explicitly mentioned, leave as 0.0\n"
+    "6. If multiple years are mentioned, extract the most recent year's data only\n\n"
+
+    "## Required Financial Data Points\n"
+    "Extract these specific line items:\n"
+    "- Products revenue\n"
+    "- Services revenue\n"
+    "- Total Revenue\n"
+    "- Cost of Revenue\n"
+    "- Gross Profit\n"
+    "- Operating Expenses\n"
+    "- Operating Income\n"
+    "- Interest Expense\n"
+    "- Interest Income\n"
+    "- Other Income/Expense\n"
+    "- Income Tax Expense\n"
+    "- Net Income\n\n"
+
+    "## Products/Services Breakdown\n"
+    "Also report how Total Revenue splits between Products and Services. If exact figures "
+    "aren't provided, estimate based on percentages or context clues.\n\n"
+
+    "## Response Format\n"
+    "Respond ONLY with a valid JSON object with this exact structure:\n"
+    "{\n"
+    "  \"buckets\": [\n"
+    "    {\"bucket\":\"Products\",\"value\":0.0},\n"
+    "    {\"bucket\":\"Services\",\"value\":0.0},\n"
+    "    {\"bucket\":\"Revenue\",\"value\":0.0},\n"
+    "    {\"bucket\":\"Cost of Revenue\",\"value\":0.0},\n"
+    "    {\"bucket\":\"Gross Profit\",\"value\":0.0},\n"
+    "    {\"bucket\":\"Operating Expenses\",\"value\":0.0},\n"
+    "    {\"bucket\":\"Operating Income\",\"value\":0.0},\n"
+    "    {\"bucket\":\"Interest Expense\",\"value\":0.0},\n"
+    "    {\"bucket\":\"Interest Income\",\"value\":0.0},\n"
+    "    {\"bucket\":\"Other Income/Expense\",\"value\":0.0},\n"
+    "    {\"bucket\":\"Taxes\",\"value\":0.0},\n"
+    "    {\"bucket\":\"Net Income\",\"value\":0.0}\n"
+    "  ],\n"
+    "  \"breakdown\": {\"Products\":0.0,\"Services\":0.0}\n"
+    "}\n\n"
+
+    "Remember: Return ONLY the JSON object with no additional commentary or explanation."
+)
+
+
+def _parse_value(m: "re.Match", group: int) -> Optional[float]:
+    """Convert the (number, unit) groups starting at `group` to millions."""
+    try:
+        val = float(m.group(group).replace(',', ''))
+    except ValueError:
+        return None
+    unit = (m.group(group + 1) or "").lower()
+    return val * UNIT_MULTIPLIER.get(unit, 1.0)
 
 
 def extract_financial_buckets_from_summary(
@@ -36,218 +184,94 @@ def extract_financial_buckets_from_summary(
     Returns values consistently in millions.
     """
     # 1) Try LLM extraction with improved prompt
-    prompt = (
-        "# Financial Data Extraction Task\n\n"
-        "You are a financial analyst specializing in SEC filings and corporate financial statements. "
-        "I need your expertise to extract precise financial data from the text below, which comes from "
-        "a company's annual report (10-K filing).\n\n"
-        
-        "## Instructions\n"
-        "1. Carefully analyze the financial summary to locate the following annual line items\n"
-        "2. Extract the *exact numerical values* as they appear in the text\n"
-        "3. Convert all values to millions of dollars for consistency\n"
-        "4. Pay special attention to units (million vs. billion) and adjust accordingly\n"
-        "5. For any value not explicitly mentioned, leave as 0.0\n"
-        "6. If multiple years are mentioned, extract the most recent year's data only\n\n"
-        
-        "## Required Financial Data Points\n"
-        "Extract these specific line items:\n"
-        "- Products revenue\n"
-        "- Services revenue\n"
-        "- Total Revenue\n"
-        "- Cost of Revenue\n"
-        "- Gross Profit\n"
-        "- Operating Expenses\n"
-        "- Operating Income\n"
-        "- Interest Expense\n"
-        "- Interest Income\n"
-        "- Other Income/Expense\n"
-        "- Income Tax Expense\n"
-        "- Net Income\n\n"
-        
-        "## Response Format\n"
-        "Respond ONLY with a valid JSON array with this exact structure:\n"
-        "[\n"
-        "  {\"bucket\":\"Products\",\"value\":0.0},\n"
-        "  {\"bucket\":\"Services\",\"value\":0.0},\n"
-        "  {\"bucket\":\"Revenue\",\"value\":0.0},\n"
-        "  {\"bucket\":\"Cost of Revenue\",\"value\":0.0},\n"
-        "  {\"bucket\":\"Gross Profit\",\"value\":0.0},\n"
-        "  {\"bucket\":\"Operating Expenses\",\"value\":0.0},\n"
-        "  {\"bucket\":\"Operating Income\",\"value\":0.0},\n"
-        "  {\"bucket\":\"Interest Expense\",\"value\":0.0},\n"
-        "  {\"bucket\":\"Interest Income\",\"value\":0.0},\n"
-        "  {\"bucket\":\"Other Income/Expense\",\"value\":0.0},\n"
-        "  {\"bucket\":\"Taxes\",\"value\":0.0},\n"
-        "  {\"bucket\":\"Net Income\",\"value\":0.0}\n"
-        "]\n\n"
-        
-        "## Financial Summary Text\n"
-        f"{summary_text}\n\n"
-        
-        "Remember: Return ONLY the JSON array with no additional commentary or explanation."
-    )
-    
-    raw = call_ollama(prompt, model=model)   
+    prompt = "## Financial Summary Text\n" + summary_text
     
-    # Strip out any Markdown before parsing
-    response = strip_markdown(raw)
+    # Structured output: Ollama constrains the response to the schema, and
+    # temperature 0 keeps the extraction deterministic
+    response = call_ollama(
+        prompt,
+        model=model,
+        format=EXTRACTION_SCHEMA,
+        options={"temperature": 0},
+        system=_EXTRACT_SYSTEM_PROMPT
+    )
 
     # Debug print
     print("🔍 LLM raw response:\n", response)
 
-    # Parse JSON from LLM - improved parsing logic
+    # Parse and validate JSON from LLM in one step (values coerced to float)
     buckets: List[Dict[str, Any]] = []
+    breakdown: Dict[str, Any] = {}
     try:
-        # Look for JSON array anywhere in the response
-        start = response.find('[')
-        end = response.rfind(']') + 1
-        if start >= 0 and end > start:
-            json_str = response[start:end]
-            buckets = json.loads(json_str)
-            print(f"✅ Successfully parsed JSON from LLM response")
-        else:
-            print("⚠️ No JSON array found in LLM response")
-    except Exception as e:
+        result = _RESULT_ADAPTER.validate_json(response)
+        buckets = [item.model_dump() for item in result.buckets]
+        breakdown = result.breakdown
+        print(f"✅ Successfully parsed JSON from LLM response")
+    except ValidationError as e:
         print(f"⚠️ Failed to parse JSON: {e}")
         buckets = []
-
-    # Validate extracted values
-    valid_buckets = all(
-        isinstance(item.get('value', 0), (int, float)) for item in buckets
-    )
     
     # Enhanced fallback with better regex patterns
-    if not buckets or not valid_buckets or all(item.get('value', 0) == 0 for item in buckets):
+    extraction_failed = not buckets or all(item.get('value', 0) == 0 for item in buckets)
+    if extraction_failed and not REGEX_FALLBACK:
+        print("⚠️ LLM extraction returned no usable values (set REGEX_FALLBACK=1 to try regex)")
+        buckets = [{"bucket": bucket, "value": 0.0} for bucket in BUCKET_LABELS]
+    elif extraction_failed:
         print("⚠️ Using regex fallback extraction")
         buckets = []
-        patterns = {
-            "Products": [
-                r"Products(?:\s+revenue)?[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?",
-                r"Product\s+sales[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?"
-            ],
-            "Services": [
-                r"Services(?:\s+revenue)?[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?",
-                r"Service\s+revenue[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?"
-            ],
-            "Revenue": [
-                r"(?:Total\s+)?Revenue[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?",
-                r"Net\s+sales[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?"
-            ],
-            "Cost of Revenue": [
-                r"Cost\s+of\s+(?:Revenue|Sales)[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?",
-                r"COGS[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?"
-            ],
-            "Gross Profit": [
-                r"Gross\s+Profit[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?",
-                r"Gross\s+Margin[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?"
-            ],
-            "Operating Expenses": [
-                r"Operating\s+Expenses[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?",
-                r"(?:Total\s+)?OPEX[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?"
-            ],
-            "Operating Income": [
-                r"Operating\s+Income[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?",
-                r"Income\s+from\s+operations[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?",
-                r"Operating\s+(?:profit|earnings)[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?"
-            ],
-            "Interest Expense": [
-                r"Interest\s+Expense[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?",
-                r"Interest\s+expenses[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?"
-            ],
-            "Interest Income": [
-                r"Interest\s+Income[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?",
-                r"Interest\s+earned[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?"
-            ],
-            "Other Income/Expense": [
-                r"Other\s+Income(?:/Expense)?[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?",
-                r"Other\s+income\s+and\s+expense[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?"
-            ],
-            "Taxes": [
-                r"(?:Income\s+)?Tax(?:es)?(?:\s+Expense)?[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?",
-                r"Provision\s+for\s+(?:income\s+)?taxes[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?"
-            ],
-            "Net Income": [
-                r"Net\s+Income[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?",
-                r"Net\s+Earnings[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?",
-                r"Net\s+Profit[^0-9$]*\$?([\d,]+(?:\.\d+)?)(?:\s*(million|billion|m|b|M|B))?"
-            ]
-        }
-        
-        # Expanded unit detection
-        unit_multiplier = {
-            "million": 1.0, "m": 1.0, "M": 1.0,
-            "billion": 1000.0, "b": 1000.0, "B": 1000.0
-        }
-        
-        for bucket, pattern_list in patterns.items():
-            val = 0.0
-            for pattern in pattern_list:
-                m = re.search(pattern, summary_text, flags=re.IGNORECASE)
-                if m:
-                    num_str = m.group(1).replace(',', '')
-                    try:
-                        val = float(num_str)
-                        unit = (m.group(2) or "").lower()
-                        val *= unit_multiplier.get(unit, 1.0)
-                        print(f"📊 Found {bucket}: {val} million")
-                        break  # Found a valid match, stop trying patterns
-                    except ValueError:
-                        continue
-            
+        # One pass over the text picks up every bucket's first match; buckets whose
+        # label was swallowed by an earlier match get a targeted search
+        found: Dict[str, float] = {}
+        for m in _BUCKET_RE.finditer(summary_text):
+            bucket = _BUCKET_SLUGS[m.lastgroup]
+            if bucket in found:
+                continue
+            val = _parse_value(m, m.lastindex + 1)
+            if val is not None:
+                found[bucket] = val
+        for bucket, rx in _BUCKET_PATTERN_RES.items():
+            if bucket not in found:
+                m = rx.search(summary_text)
+                val = _parse_value(m, 1) if m else None
+                if val is not None:
+                    found[bucket] = val
+
+        for bucket in BUCKET_LABELS:
+            val = found.get(bucket, 0.0)
+            if bucket in found:
+                print(f"📊 Found {bucket}: {val} million")
             buckets.append({"bucket": bucket, "value": val})
 
     # Validate results - check if Revenue = Products + Services
-    revenue_idx = next((i for i, item in enumerate(buckets) if item["bucket"] == "Revenue"), -1)
-    products_idx = next((i for i, item in enumerate(buckets) if item["bucket"] == "Products"), -1)
-    services_idx = next((i for i, item in enumerate(buckets) if item["bucket"] == "Services"), -1)
+    vals = {item["bucket"]: item["value"] for item in buckets}
+    revenue_val = vals.get("Revenue", 0)
 
     # If we have Revenue but no Products/Services, try to infer them from context
-    if (revenue_idx != -1 and 
-        (buckets[products_idx]["value"] == 0 or buckets[services_idx]["value"] == 0) and
-        buckets[revenue_idx]["value"] > 0):
-        
-        # Try with another prompt specifically for product/service breakdown
-        breakdown_prompt = (
-            "As a financial analyst, analyze this 10-K summary to determine the breakdown of "
-            "revenue between Products and Services. If exact figures aren't provided, estimate "
-            "based on percentages or context clues. Format your response as a JSON array with "
-            "ONLY these two values in millions of dollars:\n"
-            "[{\"bucket\":\"Products\",\"value\":0.0}, {\"bucket\":\"Services\",\"value\":0.0}]\n\n"
-            f"{summary_text}"
-        )
-        
-        try:
-            breakdown_raw = call_ollama(breakdown_prompt, model=model)
-            breakdown_resp = strip_markdown(breakdown_raw)
-            start = breakdown_resp.find('[')
-            end = breakdown_resp.rfind(']') + 1
-            if start >= 0 and end > start:
-                breakdown_json = json.loads(breakdown_resp[start:end])
-                for item in breakdown_json:
-                    if item["bucket"] == "Products" and item["value"] > 0:
-                        buckets[products_idx]["value"] = item["value"]
-                    if item["bucket"] == "Services" and item["value"] > 0:
-                        buckets[services_idx]["value"] = item["value"]
-                print("✅ Enhanced Products/Services breakdown")
-        except Exception as e:
-            print(f"⚠️ Failed to parse product/service breakdown: {e}")
+    if revenue_val > 0 and (not vals.get("Products") or not vals.get("Services")):
+        # Use the product/service breakdown returned with the main extraction
+        filled = False
+        for name in ("Products", "Services"):
+            value = breakdown.get(name, 0)
+            if isinstance(value, (int, float)) and value > 0:
+                vals[name] = value
+                filled = True
+        if filled:
+            print("✅ Enhanced Products/Services breakdown")
     
     # Final validation
     # Make sure revenue equals products + services if both are non-zero
-    if (buckets[products_idx]["value"] > 0 and buckets[services_idx]["value"] > 0):
-        sum_parts = buckets[products_idx]["value"] + buckets[services_idx]["value"]
-        revenue_val = buckets[revenue_idx]["value"]
+    products_val, services_val = vals.get("Products", 0), vals.get("Services", 0)
+    if products_val > 0 and services_val > 0:
+        sum_parts = products_val + services_val
         
-        # If there's a significant discrepancy, adjust
+        # If there's a significant discrepancy, adjust proportionally
         if abs(sum_parts - revenue_val) > 0.01 * revenue_val and revenue_val > 0:
-            # Adjust proportionally if both products and services have values
-            if buckets[products_idx]["value"] > 0 and buckets[services_idx]["value"] > 0:
-                ratio = revenue_val / sum_parts
-                buckets[products_idx]["value"] *= ratio
-                buckets[services_idx]["value"] *= ratio
-                print(f"⚠️ Adjusted Products/Services to match Revenue (ratio: {ratio:.2f})")
+            ratio = revenue_val / sum_parts
+            vals["Products"] = products_val * ratio
+            vals["Services"] = services_val * ratio
+            print(f"⚠️ Adjusted Products/Services to match Revenue (ratio: {ratio:.2f})")
 
+    buckets = [{"bucket": name, "value": value} for name, value in vals.items()]
     return buckets
 
 
@@ -262,8 +286,7 @@ def analyze_financials(
     buckets = extract_financial_buckets_from_summary(summary_text, model)
 
     out_path = output_json or os.path.splitext(summary_file)[0] + "_buckets.json"
-    with open(out_path, 'w', encoding='utf-8') as fw:
-        json.dump(buckets, fw, indent=2)
+    write_json(out_path, buckets)
 
     return out_path
 
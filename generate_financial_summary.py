@@ -1,49 +1,35 @@
 import os
+import re
+import mmap
 import argparse
-import subprocess
-from typing import Optional
+from typing import Optional, Tuple, List
 
+from ollama_client import call_ollama, SHARED_PREAMBLE
 
-def call_ollama(prompt: str, model: str = "llama3.2") -> str:
-    """
-    Sends the given prompt to a local Ollama model via CLI and returns the output.
-    """
-    cmd = ["ollama", "run", model]
-    result = subprocess.run(
-        cmd,
-        input=prompt,
-        capture_output=True,
-        text=True,
-        encoding="utf-8",
-        errors="replace",
-    )
-    if result.returncode != 0:
-        raise RuntimeError(f"Ollama call failed: {result.stderr}")
-    return result.stdout.strip()
+# Section headings written by preprocess_10k ("== Item 7: ... =="). Patterns are
+# bytes so they can scan the memory-mapped file without decoding it first.
+SECTION_HEADING_RE = re.compile(rb"== (Company Information|Item \d+[A-Z]?:[^=]*?) ==")
 
+# Sections the summary draws on: company info, business, risk factors, MD&A,
+# market risk and the financial statements
+KEEP_SECTION_RE = re.compile(rb"Company Information|Item (?:1|1A|7|7A|8):", re.IGNORECASE)
 
-def generate_financial_summary(
-    input_txt: str,
-    output_txt: Optional[str] = None,
-    pages: int = 5,
-    model: str = "llama3.2"
-) -> str:
-    """
-    Reads cleaned 10-K text, builds a data-rich financial analysis prompt,
-    invokes Llama3.2 via Ollama, and writes the summary.
-    Returns the path to the saved summary.
-    """
-    # Log start
-    print("Generating financial summary...", flush=True)
+# Fallback anchors when no Item headings survived preprocessing
+# (\S{1,3} covers both ' and the 3-byte UTF-8 curly apostrophe)
+STATEMENT_HEADING_RE = re.compile(
+    rb"CONSOLIDATED\s+(?:STATEMENTS?\s+OF\s+(?:OPERATIONS|INCOME|CASH\s+FLOWS)|BALANCE\s+SHEETS?)"
+    rb"|MANAGEMENT\S{1,3}S\s+DISCUSSION\s+AND\s+ANALYSIS",
+    re.IGNORECASE
+)
+STATEMENT_WINDOW = 8000
 
-    # Load cleaned text
-    with open(input_txt, 'r', encoding='utf-8') as f:
-        cleaned_text = f.read().strip()
 
-    # Construct financial-analyst prompt
-    prompt = (
+# Static parts of the summary prompt, built once at import; only the clipped
+# 10-K text varies per call
+_SUMMARY_PROMPT_PREFIX = (
+    SHARED_PREAMBLE +
     "You are an expert financial analyst with extensive experience extracting key information from SEC filings. Your task is to create a comprehensive, fact-based business summary from the provided 10-K text using clear bullet points. Focus on extracting all available factual information, even if the document contains limited financial details.\n\n"
-    
+
     "# INSTRUCTIONS\n"
     "1. Create a detailed business summary using ONLY verifiable facts from the 10-K\n"
     "2. Format as organized bullet points with clear section headers\n"
@@ -89,11 +75,70 @@ def generate_financial_summary(
     "• [Include any other significant factual information from the filing]\n\n"
 
     "CLEANED 10-K TEXT:\n\n"
-    f"{cleaned_text}\n\n"
-    "END."
 )
+_SUMMARY_PROMPT_SUFFIX = "\n\nEND."
 
 
+def _find_financial_windows(buf) -> List[Tuple[int, int]]:
+    """
+    Byte ranges of the sections the summary prompt needs, found in `buf`
+    (bytes or mmap). Falls back to windows around statement headings; an
+    empty list means nothing matched and the full text should be used.
+    """
+    headings = list(SECTION_HEADING_RE.finditer(buf))
+    windows = []
+    for i, m in enumerate(headings):
+        if KEEP_SECTION_RE.match(m.group(1)):
+            end = headings[i+1].start() if i < len(headings)-1 else len(buf)
+            windows.append((m.start(), end))
+
+    if not windows:
+        for m in STATEMENT_HEADING_RE.finditer(buf):
+            start, end = m.start(), min(len(buf), m.start() + STATEMENT_WINDOW)
+            if windows and start <= windows[-1][1]:
+                windows[-1] = (windows[-1][0], end)
+            else:
+                windows.append((start, end))
+    return windows
+
+
+def _read_financial_text(path: str) -> Tuple[str, int]:
+    """
+    Memory-map the cleaned text, locate the relevant sections on the raw bytes
+    and decode only those slices. Returns (clipped text, full size in bytes).
+    """
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return '', 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            windows = _find_financial_windows(mm) or [(0, size)]
+            text = '\n\n'.join(
+                mm[start:end].decode('utf-8', 'replace').strip() for start, end in windows
+            )
+    return text.strip(), size
+
+
+def generate_financial_summary(
+    input_txt: str,
+    output_txt: Optional[str] = None,
+    pages: int = 5,
+    model: str = "llama3.2"
+) -> Tuple[str, str]:
+    """
+    Reads cleaned 10-K text, builds a data-rich financial analysis prompt,
+    invokes Llama3.2 via Ollama, and writes the summary.
+    Returns the summary text and the path to the saved summary.
+    """
+    # Log start
+    print("Generating financial summary...", flush=True)
+
+    # Load only the financially relevant sections of the cleaned text to cut prefill time
+    clipped_text, full_size = _read_financial_text(input_txt)
+    print(f"Clipped input to {len(clipped_text)} characters of a {full_size}-byte file", flush=True)
+
+    # Construct financial-analyst prompt
+    prompt = _SUMMARY_PROMPT_PREFIX + clipped_text + _SUMMARY_PROMPT_SUFFIX
 
     # Generate summary
     summary = call_ollama(prompt, model=model)
@@ -105,7 +150,7 @@ def generate_financial_summary(
 
     # Log completion
     print(f"Summary saved to: {out_path}", flush=True)
-    return out_path
+    return summary, out_path
 
 
 def main():
@@ -1,44 +1,165 @@
 import os
+import re
+import mmap
 import argparse
-import subprocess
-import json
 from typing import List, Tuple, Dict, Any, Optional
 
-def call_ollama(prompt: str, model: str = "gemma3:4b") -> str:
+from ollama_client import call_ollama, batch_call_ollama, stream_ollama, write_json, SHARED_PREAMBLE
+
+
+# Grading rubric sent as the system message, byte-identical across calls so
+# the server can reuse its KV cache for this prefix
+SYSTEM_PROMPT = (
+    SHARED_PREAMBLE +
+    "You are a demanding financial editor at a top-tier business publication. "
+    "Your task is to critically evaluate the corporate financial narrative you are given. "
+    "Be strict, detailed, and focus on concrete improvements.\n\n"
+
+    "Evaluation criteria:\n"
+    "1. Factual accuracy and data representation (most important)\n"
+    "2. Clarity and logical flow of financial information\n"
+    "3. Balance between technical detail and accessibility\n"
+    "4. Integration of financial metrics into a coherent story\n"
+    "5. Appropriate context for business performance\n"
+    "6. Professional tone suited for investors and analysts\n\n"
+
+    "Instructions:\n"
+    "- Assign a score from 1-10 (be critical, reserve 9-10 for truly exceptional work)\n"
+    "- Provide 4-6 specific, actionable improvement points\n"
+    "- Focus on substantive issues, not superficial ones\n"
+    "- Be direct and specific in your criticism\n\n"
+
+    "Output in exactly this format:\n"
+    "SCORE: <number>\n"
+    "FEEDBACK:\n"
+    "- [specific improvement point]\n"
+    "- [specific improvement point]\n"
+    "..."
+)
+
+
+# Narratives above this budget (~4 chars/token, rubric included) are graded
+# section by section and the section grades are then combined
+MAX_INPUT_TOKENS = int(os.environ.get("GRADE_MAX_INPUT_TOKENS", 6000))
+RUBRIC_TOKENS = len(SYSTEM_PROMPT) // 4
+
+# Narrative files above this size are read through a memory map
+MMAP_READ_BYTES = 1 << 20
+
+# Section boundaries written by preprocess_10k, then paragraph breaks
+_SECTION_SPLIT_RE = re.compile(r"\n\n(?=== )")
+
+# "SCORE: 7", "SCORE: 7/10" or "SCORE: **7**"
+_SCORE_RE = re.compile(r"SCORE:[\s*]*(\d+)", re.IGNORECASE)
+# Same, but only once the number is complete (followed by a non-digit)
+_SCORE_DONE_RE = re.compile(r"SCORE:[\s*]*(\d+)(?=\D)", re.IGNORECASE)
+# The "FEEDBACK:" header line and the "- point" bullets after it
+_FEEDBACK_HEADER_RE = re.compile(r"^[ \t]*FEEDBACK:[ \t]*$", re.IGNORECASE | re.MULTILINE)
+_FEEDBACK_RE = re.compile(r"^[ \t]*-+[ \t]*([^-\s].*?)[ \t]*$", re.MULTILINE)
+
+
+def _parse_grade(response: str) -> Tuple[int, List[str]]:
+    """Score (0 if missing) and the feedback bullets listed under FEEDBACK:."""
+    m = _SCORE_RE.search(response)
+    score = int(m.group(1)) if m else 0
+    header = _FEEDBACK_HEADER_RE.search(response)
+    feedback = _FEEDBACK_RE.findall(response, header.end()) if header else []
+    return score, feedback
+
+
+def _read_story(path: str) -> str:
+    """Read the narrative; large files are decoded straight from a read-only mmap."""
+    if os.path.getsize(path) <= MMAP_READ_BYTES:
+        with open(path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+    with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        start, end = 0, len(mm)
+        while start < end and mm[start:start + 1].isspace():
+            start += 1
+        while end > start and mm[end - 1:end].isspace():
+            end -= 1
+        return mm[start:end].decode("utf-8", "replace")
+
+
+def _grade_prompt(story: str) -> str:
+    # Only the narrative varies per call; the rubric travels as the system prompt
+    return f"NARRATIVE TO EVALUATE:\n{story}\n\nNow produce the SCORE and FEEDBACK."
+
+
+def _split_for_grading(story: str, max_chars: int) -> List[str]:
+    """Pack sections (or paragraphs of oversized sections) into chunks of at most max_chars."""
+    parts: List[str] = []
+    for section in _SECTION_SPLIT_RE.split(story):
+        if len(section) <= max_chars:
+            parts.append(section)
+            continue
+        for para in section.split('\n\n'):
+            parts.extend(para[i:i + max_chars] for i in range(0, len(para), max_chars))
+
+    chunks: List[str] = []
+    current = ''
+    for part in parts:
+        if current and len(current) + 2 + len(part) > max_chars:
+            chunks.append(current)
+            current = part
+        else:
+            current = f"{current}\n\n{part}" if current else part
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def _stream_grade(prompt: str, model: str, score_only: bool) -> str:
     """
-    Sends a prompt to a local Ollama model via CLI and returns the raw output as plain text.
-    
-    Args:
-        prompt: The input text to send to the model
-        model: The Ollama model identifier to use
-        
-    Returns:
-        The raw text response from the model
-        
-    Raises:
-        RuntimeError: If the Ollama call fails
+    Stream the grader output, logging the score as soon as its line arrives;
+    with score_only the stream is closed right there and the partial text returned.
     """
-    cmd = ["ollama", "run", model]
-    try:
-        result = subprocess.run(
-            cmd,
-            input=prompt,
-            capture_output=True,
-            text=True,
-            encoding="utf-8",
-            errors="replace",
-        )
-        if result.returncode != 0:
-            raise RuntimeError(f"Ollama call failed: {result.stderr}")
-        return result.stdout.strip()
-    except Exception as e:
-        raise RuntimeError(f"Error calling Ollama: {str(e)}")
+    text = ''
+    scored = False
+    for piece in stream_ollama(prompt, model=model, system=SYSTEM_PROMPT):
+        text += piece
+        if not scored:
+            m = _SCORE_DONE_RE.search(text)
+            if m:
+                scored = True
+                print(f"Grader score: {m.group(1)}/10", flush=True)
+                if score_only:
+                    break
+    return text
+
+
+def _grade_response(story: str, model: str, score_only: bool = False) -> str:
+    """Raw grader output; long narratives are graded per chunk, then meta-graded."""
+    max_chars = (MAX_INPUT_TOKENS - RUBRIC_TOKENS) * 4
+    if len(story) <= max_chars:
+        return _stream_grade(_grade_prompt(story), model, score_only)
+
+    chunks = _split_for_grading(story, max_chars)
+    print(f"Narrative exceeds {MAX_INPUT_TOKENS} tokens; grading {len(chunks)} parts", flush=True)
+    prompts = [_grade_prompt(c) for c in chunks]
+    responses = batch_call_ollama(prompts, model=model, system=SYSTEM_PROMPT)
+
+    part_grades = []
+    for i, part_response in enumerate(responses, 1):
+        part_score, part_feedback = _parse_grade(part_response)
+        points = "\n".join(f"- {point}" for point in part_feedback)
+        part_grades.append(f"PART {i} SCORE: {part_score}\nPART {i} FEEDBACK:\n{points}")
+    meta_prompt = (
+        "The narrative was too long to evaluate at once, so each part was graded "
+        "separately. Combine these part grades into one overall evaluation of the "
+        "whole narrative, keeping the most important improvement points.\n\n"
+        + "\n\n".join(part_grades)
+        + "\n\nNow produce the overall SCORE and FEEDBACK."
+    )
+    return call_ollama(meta_prompt, model=model, system=SYSTEM_PROMPT)
 
 
 def grade_narrative(
     narrative_path: str,
     model: str = "gemma3:4b",
-    output_json: Optional[str] = None
+    output_json: Optional[str] = None,
+    narrative_text: Optional[str] = None,
+    score_only: bool = False
 ) -> Tuple[int, List[str]]:
     """
     Evaluates a financial narrative for quality and provides a score and critical feedback.
@@ -47,80 +168,33 @@ def grade_narrative(
         narrative_path: Path to the narrative text file to evaluate
         model: The Ollama model to use for evaluation
         output_json: Optional path to save JSON evaluation results
+        narrative_text: Narrative content already in memory; skips reading narrative_path
+        score_only: Stop reading the streamed reply once the score arrives; feedback is empty
         
     Returns:
         Tuple containing:
           - overall_score: int (1-10)
           - feedback: list of improvement points as strings
     """
-    try:
-        with open(narrative_path, "r", encoding="utf-8") as f:
-            story = f.read().strip()
-    except Exception as e:
-        raise FileNotFoundError(f"Could not read narrative file: {str(e)}")
-
-    # Enhanced grading prompt with more critical evaluation criteria
-    prompt = (
-        "You are a demanding financial editor at a top-tier business publication. "
-        "Your task is to critically evaluate the following corporate financial narrative. "
-        "Be strict, detailed, and focus on concrete improvements.\n\n"
-        
-        "Evaluation criteria:\n"
-        "1. Factual accuracy and data representation (most important)\n"
-        "2. Clarity and logical flow of financial information\n"
-        "3. Balance between technical detail and accessibility\n"
-        "4. Integration of financial metrics into a coherent story\n"
-        "5. Appropriate context for business performance\n"
-        "6. Professional tone suited for investors and analysts\n\n"
-        
-        f"NARRATIVE TO EVALUATE:\n{story}\n\n"
-        
-        "Instructions:\n"
-        "- Assign a score from 1-10 (be critical, reserve 9-10 for truly exceptional work)\n"
-        "- Provide 4-6 specific, actionable improvement points\n"
-        "- Focus on substantive issues, not superficial ones\n"
-        "- Be direct and specific in your criticism\n\n"
-        
-        "Output in exactly this format:\n"
-        "SCORE: <number>\n"
-        "FEEDBACK:\n"
-        "- [specific improvement point]\n"
-        "- [specific improvement point]\n"
-        "..."
-    )
+    if narrative_text is not None:
+        story = narrative_text.strip()
+    else:
+        try:
+            story = _read_story(narrative_path)
+        except Exception as e:
+            raise FileNotFoundError(f"Could not read narrative file: {str(e)}")
 
-    response = call_ollama(prompt, model=model)
+    response = _grade_response(story, model, score_only)
 
     # Parse plain-text response with enhanced error handling
-    lines = response.splitlines()
-    score = 0
-    feedback: List[str] = []
-    
-    in_feedback_section = False
-    
-    for line in lines:
-        line = line.strip()
-        if line.upper().startswith("SCORE:"):
-            try:
-                score_text = line.split(':', 1)[1].strip()
-                # Handle potential text scores like "7/10"
-                if '/' in score_text:
-                    score = int(score_text.split('/')[0].strip())
-                else:
-                    score = int(score_text)
-            except (ValueError, IndexError):
-                pass
-        elif line.upper() == "FEEDBACK:":
-            in_feedback_section = True
-        elif in_feedback_section and line.startswith("-"):
-            point = line.lstrip('-').strip()
-            if point:  # Only add non-empty feedback points
-                feedback.append(point)
-    
+    score, feedback = _parse_grade(response)
+    if score_only:
+        return max(1, min(10, score)), []
+
     # Ensure we have at least some feedback points
     if not feedback:
         # Try to extract any paragraph-like content as feedback
-        for line in lines:
+        for line in response.splitlines():
             if len(line.strip()) > 20 and not line.upper().startswith("SCORE:") and not line.upper() == "FEEDBACK:":
                 feedback.append(line.strip())
                 if len(feedback) >= 3:
@@ -146,8 +220,7 @@ def grade_narrative(
             "model_used": model
         }
         try:
-            with open(output_json, 'w', encoding='utf-8') as f:
-                json.dump(results, f, indent=2)
+            write_json(output_json, results)
         except Exception as e:
             print(f"Warning: Could not save results to JSON: {str(e)}")
     
@@ -0,0 +1,483 @@
+import os
+import json
+import time
+import shutil
+import subprocess
+import math
+import hashlib
+import tempfile
+import functools
+import contextlib
+import asyncio
+import threading
+import weakref
+from typing import Optional, List, Tuple, Union, Sequence, Iterator
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+# Share the response cache through Redis when the app runs with REDIS_URL
+try:
+    import redis
+except ImportError:
+    redis = None
+
+# orjson serializes several times faster and writes UTF-8 bytes directly
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
+
+# Ollama HTTP endpoint (override with OLLAMA_HOST, e.g. http://gpu-box:11434)
+OLLAMA_HOST = os.environ.get("OLLAMA_HOST", "http://127.0.0.1:11434").rstrip('/')
+
+# How long the server keeps the model resident between calls
+KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+
+# Response cache: exact prompt hash, plus an opt-in embedding-similarity tier
+CACHE_DIR = os.environ.get("OLLAMA_CACHE_DIR", ".ollama_cache")
+CACHE_ENABLED = os.environ.get("OLLAMA_CACHE", "1") != "0"
+SEMANTIC_CACHE = os.environ.get("OLLAMA_SEMANTIC_CACHE", "0") == "1"
+# Entries older than this many seconds are ignored (0 keeps them forever)
+CACHE_TTL = int(os.environ.get("OLLAMA_CACHE_TTL", 24 * 3600))
+EMBED_MODEL = os.environ.get("OLLAMA_EMBED_MODEL", "nomic-embed-text")
+SEMANTIC_THRESHOLD = 0.97
+REDIS_URL = os.environ.get("REDIS_URL")
+
+# Max concurrent generate requests per process, so parallel jobs queue here
+# instead of overloading the model server. The server only runs requests in
+# parallel when started with OLLAMA_NUM_PARALLEL (e.g. OLLAMA_NUM_PARALLEL=4
+# OLLAMA_MAX_LOADED_MODELS=2 ollama serve); keep this at or below that value.
+OLLAMA_CONCURRENCY = int(os.environ.get("OLLAMA_CONCURRENCY", 4))
+
+# Context window sent with every request unless the caller sets num_ctx. It
+# is fixed on purpose: Ollama reloads a model whenever its num_ctx changes,
+# which would drop keep_alive residency and the shared-prefix KV cache.
+# Prompts longer than this are truncated by the server, so raise it for
+# very long filings.
+NUM_CTX = int(os.environ.get("OLLAMA_NUM_CTX", 16384))
+
+# Byte-identical preamble placed at the head of every pipeline prompt. Keep it
+# free of per-call content (dates, ids) so the server can reuse its KV cache
+# for this prefix across calls to the same model.
+SHARED_PREAMBLE = (
+    "# CONTEXT\n"
+    "You are assisting with the analysis of a public company's annual report (SEC Form 10-K). "
+    "Work only from the text provided, preserve every figure exactly as stated, and follow "
+    "the task instructions and output format precisely.\n\n"
+)
+
+# One session per process so every stage reuses the same pooled keep-alive
+# connections; retries are off so an unreachable server fails over at once
+_SESSION = requests.Session()
+_SESSION.mount("http://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0))
+_SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=8, max_retries=0))
+_SESSION.headers.update({"Connection": "keep-alive", "Accept-Encoding": "gzip"})
+_SYNC_SLOTS = threading.BoundedSemaphore(OLLAMA_CONCURRENCY)
+
+# AsyncClient per running event loop
+_ASYNC_STATE: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+# In-memory copy of the semantic index: (scope, cache key, unit embedding)
+_semantic_index: Optional[List[Tuple[str, str, List[float]]]] = None
+_index_lock = threading.Lock()
+
+_REDIS = redis.Redis.from_url(REDIS_URL, decode_responses=True) if REDIS_URL and redis else None
+
+
+def _cache_key(prompt: str, model: str, params: Optional[dict] = None) -> str:
+    # Request parameters that change the output (e.g. format) are part of the key
+    head = model if not params else model + "\x00" + json.dumps(params, sort_keys=True)
+    return hashlib.sha256((head + "\x00" + prompt).encode('utf-8')).hexdigest()
+
+
+def set_cache_enabled(enabled: bool) -> None:
+    """Turn the response cache on or off for this process (CLI --no-cache)."""
+    global CACHE_ENABLED
+    CACHE_ENABLED = enabled
+
+
+def _cache_get(key: str) -> Optional[str]:
+    if _REDIS is not None:
+        return _REDIS.get(f"ollama:{key}")
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+    try:
+        if CACHE_TTL and time.time() - os.path.getmtime(path) > CACHE_TTL:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)["response"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def write_json(path: str, obj) -> None:
+    """Write obj to path as indented JSON, through orjson when it is installed."""
+    if HAS_ORJSON:
+        with open(path, 'wb') as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(obj, f, indent=2)
+
+
+def _cache_put(key: str, response: str) -> None:
+    if _REDIS is not None:
+        _REDIS.set(f"ollama:{key}", response, ex=CACHE_TTL or None)
+        return
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    path = os.path.join(CACHE_DIR, f"{key}.json")
+    # Write then rename so concurrent jobs never read a half-written entry;
+    # mkstemp names are unique across threads and worker processes alike
+    fd, tmp = tempfile.mkstemp(dir=CACHE_DIR, suffix='.tmp')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        json.dump({"response": response}, f)
+    os.replace(tmp, path)
+
+
+def _embed(text: str) -> List[float]:
+    resp = _SESSION.post(
+        f"{OLLAMA_HOST}/api/embeddings",
+        json={"model": EMBED_MODEL, "prompt": text, "keep_alive": KEEP_ALIVE},
+    )
+    resp.raise_for_status()
+    vec = resp.json()["embedding"]
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return [x / norm for x in vec]
+
+
+def _load_semantic_index() -> List[Tuple[str, str, List[float]]]:
+    global _semantic_index
+    if _semantic_index is None:
+        _semantic_index = []
+        path = os.path.join(CACHE_DIR, "semantic_index.jsonl")
+        if os.path.exists(path):
+            with open(path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        _semantic_index.append((entry["scope"], entry["key"], entry["embedding"]))
+                    except (ValueError, KeyError):
+                        continue
+    return _semantic_index
+
+
+def _semantic_lookup(prompt: str, scope: str) -> Tuple[Optional[str], Optional[List[float]]]:
+    """Return (cached response or None, prompt embedding) for the closest past prompt."""
+    try:
+        vec = _embed(prompt)
+    except (requests.RequestException, KeyError, ValueError):
+        return None, None
+    best_key, best_sim = None, SEMANTIC_THRESHOLD
+    with _index_lock:
+        for entry_scope, key, emb in _load_semantic_index():
+            if entry_scope != scope or len(emb) != len(vec):
+                continue
+            sim = sum(a * b for a, b in zip(vec, emb))
+            if sim >= best_sim:
+                best_key, best_sim = key, sim
+    if best_key is None:
+        return None, vec
+    return _cache_get(best_key), vec
+
+
+def _semantic_add(scope: str, key: str, vec: List[float]) -> None:
+    with _index_lock:
+        _load_semantic_index().append((scope, key, vec))
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(os.path.join(CACHE_DIR, "semantic_index.jsonl"), 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"scope": scope, "key": key, "embedding": vec}) + "\n")
+
+
+def _cache_lookup(prompt: str, model: str, kwargs: dict):
+    """Return (hit, key, scope, embedding); hit is None on a miss."""
+    params = {k: v for k, v in kwargs.items() if k != 'timeout' and v is not None}
+    key = _cache_key(prompt, model, params)
+    hit = _cache_get(key)
+    # Semantic hits are only shared between calls with the same model and params
+    scope = json.dumps([model, params], sort_keys=True)
+    vec = None
+    if hit is None and SEMANTIC_CACHE:
+        hit, vec = _semantic_lookup(prompt, scope)
+    return hit, key, scope, vec
+
+
+def _cache_store(key: str, scope: str, vec: Optional[List[float]], response: str) -> None:
+    _cache_put(key, response)
+    if vec is not None:
+        _semantic_add(scope, key, vec)
+
+
+class _Uncached(str):
+    """
+    Response text the cache must skip: the CLI fallback ignores format,
+    options and the system role, so its output must not be stored under a
+    key built from them.
+    """
+
+
+def cached(fn):
+    """
+    Caches LLM responses on disk keyed by sha256(model + prompt) for
+    CACHE_TTL seconds. With
+    OLLAMA_SEMANTIC_CACHE=1, a miss falls back to the most similar past prompt
+    (cosine >= SEMANTIC_THRESHOLD on Ollama embeddings) before calling the model.
+    """
+    @functools.wraps(fn)
+    def wrapper(prompt: str, model: str = "llama3.2", **kwargs) -> str:
+        if not CACHE_ENABLED:
+            return fn(prompt, model, **kwargs)
+        hit, key, scope, vec = _cache_lookup(prompt, model, kwargs)
+        if hit is not None:
+            return hit
+        response = fn(prompt, model, **kwargs)
+        if not isinstance(response, _Uncached):
+            _cache_store(key, scope, vec, response)
+        return response
+    return wrapper
+
+
+def cached_async(fn):
+    """Same cache as `cached`, for coroutines; disk/embedding work runs off the event loop."""
+    @functools.wraps(fn)
+    async def wrapper(prompt: str, model: str = "llama3.2", **kwargs) -> str:
+        if not CACHE_ENABLED:
+            return await fn(prompt, model, **kwargs)
+        hit, key, scope, vec = await asyncio.to_thread(_cache_lookup, prompt, model, kwargs)
+        if hit is not None:
+            return hit
+        response = await fn(prompt, model, **kwargs)
+        if not isinstance(response, _Uncached):
+            await asyncio.to_thread(_cache_store, key, scope, vec, response)
+        return response
+    return wrapper
+
+
+def _generate_request(
+    prompt: str,
+    model: str,
+    format: Optional[Union[str, dict]],
+    options: Optional[dict],
+    system: Optional[str] = None
+) -> Tuple[str, dict]:
+    """
+    Endpoint and JSON body: /api/generate, or /api/chat when a system prompt is given.
+    Unless the caller sets num_ctx, the fixed NUM_CTX is sent, so long prompts
+    are not truncated at the server's smaller default context.
+    """
+    payload = {
+        "model": model,
+        "stream": False,
+        "keep_alive": KEEP_ALIVE,
+    }
+    if system is None:
+        path = "/api/generate"
+        payload["prompt"] = prompt
+    else:
+        path = "/api/chat"
+        payload["messages"] = [
+            {"role": "system", "content": system},
+            {"role": "user", "content": prompt},
+        ]
+    if format:
+        payload["format"] = format
+    options = dict(options or {})
+    options.setdefault("num_ctx", NUM_CTX)
+    payload["options"] = options
+    return path, payload
+
+
+def _response_text(data: dict) -> str:
+    if "message" in data:
+        return data["message"]["content"].strip()
+    return data["response"].strip()
+
+
+def _call_ollama_cli(prompt: str, model: str) -> str:
+    """Fallback when the HTTP endpoint is unreachable: one `ollama run` subprocess; never cached."""
+    try:
+        result = subprocess.run(
+            ["ollama", "run", model],
+            input=prompt,
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            errors="replace",
+        )
+    except OSError as e:
+        raise RuntimeError(f"Error calling Ollama: {e}")
+    if result.returncode != 0:
+        raise RuntimeError(f"Ollama call failed: {result.stderr}")
+    return _Uncached(result.stdout.strip())
+
+
+@cached
+def call_ollama(
+    prompt: str,
+    model: str = "llama3.2",
+    format: Optional[Union[str, dict]] = None,
+    options: Optional[dict] = None,
+    timeout: Optional[float] = None,
+    system: Optional[str] = None
+) -> str:
+    """
+    Sends the given prompt to the local Ollama server over HTTP and returns the output.
+    The model is kept loaded (keep_alive) so consecutive pipeline stages skip the cold load.
+    Pass format="json" (or a JSON schema dict) to have Ollama constrain the output, and
+    options (e.g. temperature) to override model parameters; num_ctx defaults to NUM_CTX.
+    A `system` prompt is sent as the system message of an /api/chat request, so a
+    fixed system prompt forms a stable prefix across calls.
+    At most OLLAMA_CONCURRENCY requests per process are in flight at once.
+    If the server cannot be reached, falls back to the `ollama` CLI when installed
+    (format and options are not applied on that path).
+    """
+    path, payload = _generate_request(prompt, model, format, options, system)
+    try:
+        with _SYNC_SLOTS:
+            resp = _SESSION.post(f"{OLLAMA_HOST}{path}", json=payload, timeout=timeout)
+        resp.raise_for_status()
+    except requests.ConnectionError as e:
+        if shutil.which("ollama") is None:
+            raise RuntimeError(f"Ollama call failed: {e}")
+        print(f"⚠️ Ollama HTTP endpoint unreachable, falling back to CLI: {e}", flush=True)
+        return _call_ollama_cli(prompt if system is None else f"{system}\n\n{prompt}", model)
+    except requests.RequestException as e:
+        raise RuntimeError(f"Ollama call failed: {e}")
+    return _response_text(resp.json())
+
+
+def stream_ollama(
+    prompt: str,
+    model: str = "llama3.2",
+    format: Optional[Union[str, dict]] = None,
+    options: Optional[dict] = None,
+    timeout: Optional[float] = None,
+    system: Optional[str] = None
+) -> Iterator[str]:
+    """
+    Streaming form of call_ollama: yields the completion piece by piece as the
+    server generates it, so callers can act on the first lines early. Shares
+    call_ollama's cache; a cached response is yielded in one piece, and only a
+    stream read to the end is stored.
+    """
+    kwargs = {"format": format, "options": options, "timeout": timeout, "system": system}
+    kwargs = {k: v for k, v in kwargs.items() if v is not None}
+    hit = key = scope = vec = None
+    if CACHE_ENABLED:
+        hit, key, scope, vec = _cache_lookup(prompt, model, kwargs)
+        if hit is not None:
+            yield hit
+            return
+
+    path, payload = _generate_request(prompt, model, format, options, system)
+    payload["stream"] = True
+    pieces: List[str] = []
+    try:
+        with _SYNC_SLOTS, _SESSION.post(
+            f"{OLLAMA_HOST}{path}", json=payload, timeout=timeout, stream=True
+        ) as resp:
+            resp.raise_for_status()
+            for line in resp.iter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                piece = data["message"]["content"] if "message" in data else data.get("response", "")
+                if piece:
+                    pieces.append(piece)
+                    yield piece
+                if data.get("done"):
+                    break
+    except requests.ConnectionError as e:
+        if pieces or shutil.which("ollama") is None:
+            raise RuntimeError(f"Ollama call failed: {e}")
+        print(f"⚠️ Ollama HTTP endpoint unreachable, falling back to CLI: {e}", flush=True)
+        yield _call_ollama_cli(prompt if system is None else f"{system}\n\n{prompt}", model)
+        return
+    except requests.RequestException as e:
+        raise RuntimeError(f"Ollama call failed: {e}")
+
+    if CACHE_ENABLED:
+        _cache_store(key, scope, vec, "".join(pieces).strip())
+
+
+def _async_client() -> httpx.AsyncClient:
+    """Per-event-loop AsyncClient (it is bound to the loop that uses it)."""
+    loop = asyncio.get_running_loop()
+    client = _ASYNC_STATE.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(base_url=OLLAMA_HOST)
+        _ASYNC_STATE[loop] = client
+    return client
+
+
+@contextlib.asynccontextmanager
+async def _process_slot():
+    """Hold one of the process-wide _SYNC_SLOTS from async code, shared with call_ollama."""
+    acquiring = asyncio.ensure_future(asyncio.to_thread(_SYNC_SLOTS.acquire))
+    try:
+        await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        # The worker thread still takes the slot; hand it back once it does
+        def _release(fut):
+            if not fut.cancelled() and fut.exception() is None:
+                _SYNC_SLOTS.release()
+        acquiring.add_done_callback(_release)
+        raise
+    try:
+        yield
+    finally:
+        _SYNC_SLOTS.release()
+
+
+@cached_async
+async def acall_ollama(
+    prompt: str,
+    model: str = "llama3.2",
+    format: Optional[Union[str, dict]] = None,
+    options: Optional[dict] = None,
+    timeout: Optional[float] = None,
+    system: Optional[str] = None
+) -> str:
+    """
+    Async counterpart of call_ollama over httpx.AsyncClient, so one thread can
+    await many generations. Shares call_ollama's OLLAMA_CONCURRENCY slots, so
+    the cap holds per process across sync, streaming and async calls, and
+    falls back to the `ollama` CLI the same way when the server is unreachable.
+    """
+    client = _async_client()
+    path, payload = _generate_request(prompt, model, format, options, system)
+    try:
+        async with _process_slot():
+            resp = await client.post(path, json=payload, timeout=timeout)
+        resp.raise_for_status()
+    except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+        if shutil.which("ollama") is None:
+            raise RuntimeError(f"Ollama call failed: {e}")
+        print(f"⚠️ Ollama HTTP endpoint unreachable, falling back to CLI: {e}", flush=True)
+        return await asyncio.to_thread(
+            _call_ollama_cli, prompt if system is None else f"{system}\n\n{prompt}", model
+        )
+    except httpx.HTTPError as e:
+        raise RuntimeError(f"Ollama call failed: {e}")
+    return _response_text(resp.json())
+
+
+async def _gather_generations(prompts: Sequence[str], model: str, kwargs: dict) -> List[str]:
+    try:
+        return list(await asyncio.gather(*(acall_ollama(p, model, **kwargs) for p in prompts)))
+    finally:
+        client = _ASYNC_STATE.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.aclose()
+
+
+def batch_call_ollama(prompts: Sequence[str], model: str = "llama3.2", **kwargs) -> List[str]:
+    """
+    Sends independent prompts to the same model concurrently and returns the
+    responses in order, so a server with OLLAMA_NUM_PARALLEL > 1 can batch them.
+    Accepts the same keyword arguments as call_ollama. Call from synchronous code only.
+    """
+    if not prompts:
+        return []
+    return asyncio.run(_gather_generations(prompts, model, kwargs))
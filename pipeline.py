@@ -1,7 +1,10 @@
 import os
-import json
+import shutil
+import hashlib
+import tempfile
+import asyncio
 import argparse
-from typing import Optional
+from typing import Optional, Callable, Dict, Any
 
 from preprocess_10k import preprocess_10k
 from generate_financial_summary import generate_financial_summary
@@ -9,6 +12,158 @@ from grade_narrative import grade_narrative
 from extract_financials import analyze_financials
 from visualize_sankey import plot_sankey
 from create_story import create_narrative
+from ollama_client import set_cache_enabled, write_json
+
+
+# Cleaned text per PDF fingerprint, so reruns on an unchanged PDF skip Step 1.
+# Bump PREPROCESS_VERSION whenever preprocess_10k changes its output.
+PREPROCESS_CACHE_DIR = os.environ.get("PREPROCESS_CACHE_DIR", ".cache")
+PREPROCESS_VERSION = "v1"
+
+
+def _log(message: str) -> None:
+    print(message, flush=True)
+
+
+def _pdf_fingerprint(pdf_path: str) -> str:
+    digest = hashlib.sha256()
+    with open(pdf_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return f"{digest.hexdigest()[:16]}_{PREPROCESS_VERSION}"
+
+
+def _preprocess_cached(pdf_path: str, cleaned_txt: str, log: Callable[[str], None]) -> None:
+    """Run preprocess_10k, or copy its earlier output for the same PDF bytes from the cache."""
+    cached_txt = os.path.join(PREPROCESS_CACHE_DIR, f"{_pdf_fingerprint(pdf_path)}_cleaned.txt")
+    if os.path.exists(cached_txt):
+        shutil.copyfile(cached_txt, cleaned_txt)
+        log("-> PDF unchanged, reusing cached cleaned text.")
+        return
+    preprocess_10k(
+        input_pdf=pdf_path,
+        output_txt=cleaned_txt
+    )
+    os.makedirs(PREPROCESS_CACHE_DIR, exist_ok=True)
+    # Unique temp name: concurrent jobs in one process may cache the same PDF
+    fd, tmp = tempfile.mkstemp(dir=PREPROCESS_CACHE_DIR, suffix='.tmp')
+    os.close(fd)
+    shutil.copyfile(cleaned_txt, tmp)
+    os.replace(tmp, cached_txt)
+
+
+async def arun_pipeline(
+    pdf_path: str,
+    pages: int = 3,
+    story_model: str = "llama3.2",
+    grade_model: str = "gemma3:4b",
+    log: Callable[[str], None] = _log,
+    sequential: bool = False
+) -> Dict[str, Any]:
+    """
+    Runs preprocess, summary, grading, narrative and Sankey steps for one 10-K PDF.
+    Bucket extraction only needs the cleaned text, so it runs alongside the
+    summary/grade/narrative chain; the model server must allow parallel
+    requests (OLLAMA_NUM_PARALLEL >= 2) for the two to actually overlap.
+    With sequential=True the steps run strictly one after another.
+    Progress lines are passed to `log`. Returns the output paths and grade score.
+    """
+    base, _ = os.path.splitext(pdf_path)
+    cleaned_txt     = f"{base}_cleaned.txt"
+    summary_txt     = f"{base}_financial_overview.txt"
+    grade_json      = f"{base}_overview_grade.json"
+    narrative_txt   = f"{base}_narrative.txt"
+    buckets_json    = f"{base}_financials.json"
+    sankey_html     = f"{base}_sankey.html"
+
+    # Step 1: Preprocessing
+    log("Step 1/5: Preprocessing 10-K PDF...")
+    await asyncio.to_thread(_preprocess_cached, pdf_path, cleaned_txt, log)
+    log("-> Preprocessing complete.")
+
+    async def narrative_steps():
+        # Step 2: Generate financial summary
+        log("Step 2/5: Generating financial summary...")
+        summary_content, _ = await asyncio.to_thread(
+            generate_financial_summary,
+            input_txt=cleaned_txt,
+            output_txt=summary_txt,
+            pages=pages,
+            model=story_model
+        )
+        log("-> Financial summary complete.")
+
+        # Step 3: Grade the financial overview
+        log("Step 3/5: Grading financial overview...")
+        score, feedback = await asyncio.to_thread(
+            grade_narrative,
+            narrative_path=summary_txt,
+            model=grade_model,
+            narrative_text=summary_content
+        )
+        # Save grading output
+        grade = {"score": score, "feedback": feedback}
+        write_json(grade_json, grade)
+        log("-> Grading complete.")
+
+        # Step 4: Create narrative from summary
+        log("Step 4/5: Creating narrative based on feedback...")
+        _, narrative_out = await asyncio.to_thread(
+            create_narrative,
+            cleaned_txt=cleaned_txt,
+            pages=pages,
+            summary_model=story_model,
+            grade_model=grade_model,
+            output_initial=summary_txt,
+            output_refined=narrative_txt
+        )
+        log("-> Narrative creation complete.")
+        return score, narrative_out
+
+    async def bucket_steps():
+        # Step 5: Extract and visualize financial buckets
+        log("Step 5/5: Extracting financial buckets and generating Sankey...")
+        await asyncio.to_thread(
+            analyze_financials,
+            summary_file=cleaned_txt,
+            output_json=buckets_json,
+            model=grade_model
+        )
+        log("-> Buckets extraction complete.")
+        await asyncio.to_thread(
+            plot_sankey,
+            json_path=buckets_json,
+            output_html=sankey_html
+        )
+        log("-> Sankey chart complete.")
+
+    if sequential:
+        score, narrative_out = await narrative_steps()
+        await bucket_steps()
+    else:
+        (score, narrative_out), _ = await asyncio.gather(narrative_steps(), bucket_steps())
+
+    return {
+        "cleaned": cleaned_txt,
+        "summary": summary_txt,
+        "grade": grade_json,
+        "score": score,
+        "narrative": narrative_out,
+        "buckets": buckets_json,
+        "sankey": sankey_html,
+    }
+
+
+def run_pipeline(
+    pdf_path: str,
+    pages: int = 3,
+    story_model: str = "llama3.2",
+    grade_model: str = "gemma3:4b",
+    log: Callable[[str], None] = _log,
+    sequential: bool = False
+) -> Dict[str, Any]:
+    """Synchronous entry point for arun_pipeline (CLI, web jobs and RQ workers)."""
+    return asyncio.run(arun_pipeline(pdf_path, pages, story_model, grade_model, log, sequential))
 
 
 def main():
@@ -31,79 +186,35 @@ def main():
         "--grade-model", default="gemma3:4b",
         help="Ollama model for grading narratives"
     )
-    args = parser.parse_args()
-
-    base, _ = os.path.splitext(args.input_pdf)
-    cleaned_txt     = f"{base}_cleaned.txt"
-    summary_txt     = f"{base}_financial_overview.txt"
-    grade_json      = f"{base}_overview_grade.json"
-    narrative_txt   = f"{base}_narrative.txt"
-    buckets_json    = f"{base}_financials.json"
-    sankey_html     = f"{base}_sankey.html"
-
-    # Step 1: Preprocessing
-    print("Step 1/5: Preprocessing 10-K PDF...", flush=True)
-    preprocess_10k(
-        input_pdf=args.input_pdf,
-        output_txt=cleaned_txt
+    parser.add_argument(
+        "--sequential", action="store_true",
+        help="Run every step one after another (for debugging or a single-slot model server)"
     )
-    print("-> Preprocessing complete.", flush=True)
-
-    # Step 2: Generate financial summary
-    print("Step 2/5: Generating financial summary...", flush=True)
-    generate_financial_summary(
-        input_txt=cleaned_txt,
-        output_txt=summary_txt,
-        pages=args.pages,
-        model=args.story_model
+    parser.add_argument(
+        "--no-cache", action="store_true",
+        help="Always call the model instead of reusing cached responses"
     )
-    print("-> Financial summary complete.", flush=True)
+    args = parser.parse_args()
 
-    # Step 3: Grade the financial overview
-    print("Step 3/5: Grading financial overview...", flush=True)
-    score, feedback = grade_narrative(
-        narrative_path=summary_txt,
-        model=args.grade_model
-    )
-    # Save grading output
-    with open(grade_json, 'w', encoding='utf-8') as f:
-        json.dump({"score": score, "feedback": feedback}, f, indent=2)
-    print("-> Grading complete.", flush=True)
-
-    # Step 4: Create narrative from summary
-    print("Step 4/5: Creating narrative based on feedback...", flush=True)
-    _, narrative_out = create_narrative(
-        cleaned_txt=cleaned_txt,
+    if args.no_cache:
+        set_cache_enabled(False)
+
+    outputs = run_pipeline(
+        pdf_path=args.input_pdf,
         pages=args.pages,
-        summary_model=args.story_model,
+        story_model=args.story_model,
         grade_model=args.grade_model,
-        output_initial=summary_txt,
-        output_refined=narrative_txt
-    )
-    print("-> Narrative creation complete.", flush=True)
-
-    # Step 5: Extract and visualize financial buckets
-    print("Step 5/5: Extracting financial buckets and generating Sankey...", flush=True)
-    analyze_financials(
-        summary_file=cleaned_txt,
-        output_json=buckets_json,
-        model=args.grade_model
-    )
-    print("-> Buckets extraction complete.", flush=True)
-    plot_sankey(
-        json_path=buckets_json,
-        output_html=sankey_html
+        sequential=args.sequential
     )
-    print("-> Sankey chart complete.", flush=True)
 
     # Summary of outputs
     print("[Done] Pipeline complete!", flush=True)
-    print(f"  Cleaned text:          {cleaned_txt}", flush=True)
-    print(f"  Financial overview:    {summary_txt}", flush=True)
-    print(f"  Grade (score):         {score}/10", flush=True)
-    print(f"  Narrative:             {narrative_out}", flush=True)
-    print(f"  Financial buckets:     {buckets_json}", flush=True)
-    print(f"  Sankey diagram:        {sankey_html}", flush=True)
+    print(f"  Cleaned text:          {outputs['cleaned']}", flush=True)
+    print(f"  Financial overview:    {outputs['summary']}", flush=True)
+    print(f"  Grade (score):         {outputs['score']}/10", flush=True)
+    print(f"  Narrative:             {outputs['narrative']}", flush=True)
+    print(f"  Financial buckets:     {outputs['buckets']}", flush=True)
+    print(f"  Sankey diagram:        {outputs['sankey']}", flush=True)
 
 
 if __name__ == '__main__':
@@ -1,9 +1,12 @@
+import io
 import os
 import re
 import argparse
 import time
-from typing import Optional, List, Dict
+import multiprocessing
+from typing import Optional, List, Dict, Iterable, Iterator
 from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
 
 # Attempt to import LangChain PDF loader, else fallback to PyPDF2
 try:
@@ -11,16 +14,36 @@ try:
     HAS_LANGCHAIN = True
 except ImportError:
     HAS_LANGCHAIN = False
-    from PyPDF2 import PdfReader
 
-import nltk
+# pypdfium2 (PDFium bindings) extracts text several times faster than the pure-Python readers
+try:
+    import pypdfium2 as pdfium
+    HAS_PDFIUM = True
+except ImportError:
+    HAS_PDFIUM = False
 
-# Download NLTK resources if not already present
-for resource in ['tokenizers/punkt', 'corpora/stopwords']:
-    try:
-        nltk.data.find(resource)
-    except LookupError:
-        nltk.download(resource.split('/')[-1])
+# google-re2 matches the fused boilerplate pattern as a linear-time DFA scan
+try:
+    import re2
+    HAS_RE2 = True
+except ImportError:
+    HAS_RE2 = False
+
+# pyarrow runs the header/footer line filter as vectorized C++ kernels on large filings
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    HAS_PYARROW = True
+except ImportError:
+    HAS_PYARROW = False
+
+# xxhash gives a fast 64-bit line hash for header/footer detection; the
+# built-in str hash is enough within one process
+try:
+    import xxhash
+    _line_hash = xxhash.xxh3_64_intdigest
+except ImportError:
+    _line_hash = hash
 
 # Common financial/legal boilerplate patterns
 BOILERPLATE_PATTERNS = [
@@ -39,13 +62,109 @@ BOILERPLATE_PATTERNS = [
     r"^\s*ITEM\s+\d+[A-Z]?\s*$",
 ]
 
-# Precompile regexes for performance
-device_boilerplate_regexes = [re.compile(pat, re.IGNORECASE) for pat in BOILERPLATE_PATTERNS]
-ITEM_REGEX = re.compile(r"(?:ITEM|Item)\s+(\d+[A-Z]?)[.\s]+([^\n]+)")
+
+def _compile_fast(pattern: str):
+    """Compile with re2 when available (flags must be inline), else with re."""
+    if HAS_RE2:
+        try:
+            return re2.compile(pattern)
+        except re2.error:
+            pass
+    return re.compile(pattern)
+
+
+# All boilerplate patterns (plus U.S.C./§ citations) fused into one alternation
+# so a section is scanned once instead of once per pattern
+BOILERPLATE_UNION = _compile_fast(
+    "(?i)" + "|".join(f"(?:{pat})" for pat in BOILERPLATE_PATTERNS)
+    + r"|(?-i:\d+\s*U\.S\.C\.|§\s*\d+[a-z]*)"
+)
+MULTI_WS_RE = re.compile(r"\s{2,}")
+
+# One pass for clean_section: bullets (with trailing whitespace) become "* ",
+# lone \r and \t are normalized, and whitespace runs collapse to one space
+# (a bare \r\n counts as a single newline)
+SECTION_WS_RE = re.compile(r"[•◦●▪]\s*|\s{2,}|[\r\t]")
+# \b keeps words ending in "item" (e.g. "LineItem 5") from starting a section
+ITEM_REGEX = re.compile(r"\b(?:ITEM|Item)\s+(\d+[A-Z]?)[.\s]+([^\n]+)")
+
+# Minimum pages per worker process before page extraction is parallelized
+PAGES_PER_WORKER = 10
+
+# pypdfium2 is fast enough that a process pool only pays off on long filings
+PDFIUM_PARALLEL_PAGES = 50
+
+# Documents with more characters than this use the pyarrow header/footer filter
+ARROW_MIN_CHARS = 2 << 20
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> List[Dict]:
+    """Extract pages [start, stop) in a worker process; each worker opens the PDF once."""
+    from PyPDF2 import PdfReader
+    reader = PdfReader(pdf_path)
+    return [
+        {'page_num': i+1, 'content': reader.pages[i].extract_text() or ''}
+        for i in range(start, stop)
+    ]
+
+
+def _extract_page_range_pdfium(pdf_path: str, start: int, stop: int) -> List[Dict]:
+    """Extract pages [start, stop) with pypdfium2; each worker opens the PDF once."""
+    pdf = pdfium.PdfDocument(pdf_path)
+    try:
+        return [
+            {'page_num': i+1, 'content': pdf[i].get_textpage().get_text_range().replace('\r\n', '\n')}
+            for i in range(start, stop)
+        ]
+    finally:
+        pdf.close()
+
+
+def _map_page_ranges(extract, pdf_path: str, total: int, workers: int) -> List[Dict]:
+    """Run `extract` over contiguous page ranges in a process pool, merged back in page order."""
+    step = -(-total // workers)
+    starts = range(0, total, step)
+    stops = [min(start + step, total) for start in starts]
+    pages: List[Dict] = []
+    # Spawned, not forked: this runs from job threads in the web process, and a
+    # fork could copy locks other threads hold into the children
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        for chunk in pool.map(extract, [pdf_path] * len(starts), starts, stops):
+            pages.extend(chunk)
+    return pages
+
+
+def extract_pages_pdfium(pdf_path: str) -> List[Dict]:
+    """Extract pages with pypdfium2, across a process pool above PDFIUM_PARALLEL_PAGES pages."""
+    pdf = pdfium.PdfDocument(pdf_path)
+    total = len(pdf)
+    pdf.close()
+    workers = min(os.cpu_count() or 1, total // PAGES_PER_WORKER)
+    if total <= PDFIUM_PARALLEL_PAGES or workers < 2:
+        return _extract_page_range_pdfium(pdf_path, 0, total)
+    return _map_page_ranges(_extract_page_range_pdfium, pdf_path, total, workers)
+
+
+def extract_pages_parallel(pdf_path: str) -> Optional[List[Dict]]:
+    """Extract pages across a process pool; returns None if the PDF is too small to benefit."""
+    try:
+        from PyPDF2 import PdfReader
+    except ImportError:
+        return None
+    total = len(PdfReader(pdf_path).pages)
+    workers = min(os.cpu_count() or 1, total // PAGES_PER_WORKER)
+    if workers < 2:
+        return None
+    return _map_page_ranges(_extract_page_range, pdf_path, total, workers)
 
 
 def extract_full_text(pdf_path: str) -> List[Dict]:
     """Extract text from PDF with page numbers."""
+    if HAS_PDFIUM:
+        return extract_pages_pdfium(pdf_path)
+    pages = extract_pages_parallel(pdf_path)
+    if pages is not None:
+        return pages
     if HAS_LANGCHAIN:
         loader = PyPDFLoader(pdf_path)
         pages_loaded = loader.load()
@@ -54,6 +173,7 @@ def extract_full_text(pdf_path: str) -> List[Dict]:
             for i, page in enumerate(pages_loaded)
         ]
     else:
+        from PyPDF2 import PdfReader
         reader = PdfReader(pdf_path)
         return [
             {'page_num': i+1, 'content': page.extract_text() or ''}
@@ -61,61 +181,124 @@ def extract_full_text(pdf_path: str) -> List[Dict]:
         ]
 
 
-def clean_headers_footers(pages: List[Dict]) -> List[Dict]:
-    """Remove repeating headers and footers efficiently."""
-    total = len(pages)
-    sample = min(5, total)
-    all_lines = []
-    for page in pages[:sample]:
-        for ln in page['content'].split('\n'):
-            ln = ln.strip()
-            if ln and len(ln) < 100:
-                all_lines.append(ln)
-    threshold = max(2, total * 0.05)
-    repeater = Counter(all_lines)
-    repeating = {ln for ln, cnt in repeater.items() if cnt >= threshold}
-
-    cleaned = []
+def _clean_headers_footers_arrow(pages: List[Dict], threshold: float) -> Iterator[Dict]:
+    """clean_headers_footers over one pyarrow array of every line in the document."""
+    split = pc.split_pattern(pa.array([page['content'] for page in pages], type=pa.string()), '\n')
+    lines = split.flatten()
+    page_ids = split.value_parent_indices()
+
+    stripped = pc.utf8_trim_whitespace(lines)
+    length = pc.utf8_length(stripped)
+    candidate = pc.and_(pc.greater(length, 0), pc.less(length, 100))
+
+    # Pages each short line appears on; lines on enough pages are headers/footers
+    per_line = (
+        pa.table({'page': page_ids, 'line': stripped})
+        .filter(candidate)
+        .group_by('line')
+        .aggregate([('page', 'count_distinct')])
+    )
+    repeating = per_line.filter(pc.greater_equal(per_line['page_count_distinct'], threshold))['line']
+    keep = pc.invert(pc.is_in(stripped, value_set=repeating.combine_chunks()))
+
+    # Kept lines regrouped per page: each page ends where the running count of
+    # kept lines stands at its last original line
+    kept_through = pc.cumulative_sum(pc.cast(keep, pa.int32()))
+    ends = pc.take(kept_through, pc.subtract(split.offsets[1:], 1))
+    offsets = pa.concat_arrays([pa.array([0], type=pa.int32()), ends])
+    cleaned = pc.binary_join(pa.ListArray.from_arrays(offsets, pc.filter(lines, keep)), '\n')
+    del split, lines, stripped, keep
+
+    for page, content in zip(pages, cleaned):
+        page['content'] = None
+        yield {'page_num': page['page_num'], 'content': content.as_py()}
+
+
+def clean_headers_footers(pages: List[Dict]) -> Iterator[Dict]:
+    """
+    Remove repeating headers and footers efficiently. Yields the cleaned pages
+    one at a time and releases each raw page's content (set to None) as it is
+    yielded, so the raw and cleaned text are never both held in full.
+    """
+    threshold = max(2, len(pages) * 0.05)
+    if HAS_PYARROW and sum(len(page['content']) for page in pages) > ARROW_MIN_CHARS:
+        yield from _clean_headers_footers_arrow(pages, threshold)
+        return
+
+    # Count, over every page, how many pages each short line appears on;
+    # lines are counted by hash so the Counter holds ints, not strings. Each
+    # page's hashes are kept (None for lines that can't repeat) so the filter
+    # pass below neither strips nor hashes a line a second time.
+    strip, line_hash = str.strip, _line_hash
+    repeater = Counter()
+    page_hashes = []
+    append_hashes = page_hashes.append
     for page in pages:
-        kept = [ln for ln in page['content'].split('\n') if ln.strip() not in repeating]
-        cleaned.append({'page_num': page['page_num'], 'content': '\n'.join(kept)})
-    return cleaned
+        hashes = [
+            line_hash(ln) if ln and len(ln) < 100 else None
+            for ln in map(strip, page['content'].split('\n'))
+        ]
+        append_hashes(hashes)
+        repeater.update(set(hashes))
+    repeater.pop(None, None)
+    repeating = frozenset(h for h, cnt in repeater.items() if cnt >= threshold)
+
+    for page, hashes in zip(pages, page_hashes):
+        lines = page['content'].split('\n')
+        page['content'] = None
+        kept = [ln for ln, h in zip(lines, hashes) if h not in repeating]
+        yield {'page_num': page['page_num'], 'content': '\n'.join(kept)}
 
 
 def remove_boilerplate(text: str) -> str:
     """Strip boilerplate patterns."""
-    for rx in device_boilerplate_regexes:
-        text = rx.sub('', text)
-    text = re.sub(r"\d+\s*U\.S\.C\.|§\s*\d+[a-z]*", '', text)
-    text = re.sub(r"\s{2,}", ' ', text)
-    text = re.sub(r"\n{2,}", '\n', text)
+    text = BOILERPLATE_UNION.sub('', text)
+    text = MULTI_WS_RE.sub(' ', text)
     return text.strip()
 
 
+def _section_ws(m: "re.Match") -> str:
+    run = m.group(0)
+    if run[0] in '•◦●▪':
+        return '* '
+    if run == '\r\n' or run == '\r':
+        return '\n'
+    # A lone tab or a run of 2+ whitespace characters
+    return ' '
+
+
 def clean_section(text: str) -> str:
     """Normalize section text."""
-    text = re.sub(r"[•◦●▪]", '* ', text)
-    text = re.sub(r"\r\n?", '\n', text)
-    text = re.sub(r"\t", ' ', text)
-    text = re.sub(r"\s{2,}", ' ', text)
-    text = re.sub(r"\n{3,}", '\n\n', text)
-    return text.strip()
+    return SECTION_WS_RE.sub(_section_ws, text).strip()
 
 
-def extract_sections(pages: List[Dict]) -> Dict[str, str]:
-    """Extract key sections from 10-K based on Item numbers."""
-    full = '\n'.join(page['content'] for page in pages)
-    matches = list(ITEM_REGEX.finditer(full))
+def extract_sections(pages: Iterable[Dict]) -> Dict[str, str]:
+    """Extract key sections from 10-K based on Item numbers; `pages` is consumed once."""
+    # Written page by page; join() would list every page before joining
+    buf = io.StringIO()
+    for i, page in enumerate(pages):
+        if i:
+            buf.write('\n')
+        buf.write(page['content'])
+    full = buf.getvalue()
+    del buf
     sections = {}
-    for i, m in enumerate(matches):
-        start = m.end()
-        end = matches[i+1].start() if i < len(matches)-1 else len(full)
-        sec = clean_section(full[start:end])
+
+    def add_section(m: "re.Match", end: int) -> None:
+        sec = clean_section(full[m.end():end])
         sec = remove_boilerplate(sec)
         if len(sec) > 100:
-            sections[f"Item {m.group(1)}: {m.group(2).strip()}"] = sec
-    if matches:
-        meta = clean_section(full[:matches[0].start()])
+            sections[f"Item {m.group(1)}: {MULTI_WS_RE.sub(' ', m.group(2).strip())}"] = sec
+
+    # Stream the matches with one match of lookahead instead of listing them all
+    matches = ITEM_REGEX.finditer(full)
+    first = prev = next(matches, None)
+    for m in matches:
+        add_section(prev, m.start())
+        prev = m
+    if prev is not None:
+        add_section(prev, len(full))
+        meta = clean_section(full[:first.start()])
         if meta:
             sections['Company Information'] = meta
     return sections
@@ -128,19 +311,16 @@ def preprocess_10k(input_pdf: str, output_txt: Optional[str] = None) -> str:
     pages = extract_full_text(input_pdf)
     print(f"Extraction took {time.time()-t0:.1f}s for {len(pages)} pages", flush=True)
 
-    print("Cleaning headers and footers...", flush=True)
+    # Header/footer cleaning streams page by page into section extraction
+    print("Cleaning headers and footers and extracting key sections...", flush=True)
     t1 = time.time()
-    cleaned = clean_headers_footers(pages)
-    print(f"Cleaning took {time.time()-t1:.1f}s", flush=True)
-
-    print("Extracting key sections...", flush=True)
-    t2 = time.time()
-    sections = extract_sections(cleaned)
-    print(f"Section extraction took {time.time()-t2:.1f}s for {len(sections)} sections", flush=True)
+    sections = extract_sections(clean_headers_footers(pages))
+    del pages
+    print(f"Cleaning and section extraction took {time.time()-t1:.1f}s for {len(sections)} sections", flush=True)
 
+    # Section bodies are already whitespace-normalized, so only the separators
+    # add blank lines and no whole-document pass is needed
     final = ''.join(f"\n\n== {k} ==\n\n{v}" for k,v in sections.items())
-    final = re.sub(r"\s{2,}", ' ', final)
-    final = re.sub(r"\n{3,}", '\n\n', final)
 
     out = output_txt or os.path.splitext(input_pdf)[0] + '_processed.txt'
     with open(out, 'w', encoding='utf-8') as f:
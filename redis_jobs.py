@@ -0,0 +1,165 @@
+import os
+import uuid
+import threading
+import contextlib
+from typing import Callable, Dict, Iterator, List, Optional
+
+# Redis/RQ are only needed when REDIS_URL is set; otherwise app.py keeps jobs in memory
+try:
+    import redis
+    from rq import Queue as RQQueue
+    from rq.exceptions import NoSuchJobError
+    from rq.job import Job as RQJob, JobStatus
+    HAS_REDIS = True
+except ImportError:
+    HAS_REDIS = False
+
+REDIS_URL = os.environ.get('REDIS_URL')
+
+# Job hashes and log streams expire after a week
+JOB_TTL = 7 * 24 * 3600
+
+# Upper bound for one pipeline run inside an RQ worker
+PIPELINE_TIMEOUT = 2 * 3600
+
+
+def _job_key(job_id: str) -> str:
+    return f"job:{job_id}"
+
+
+def _log_key(job_id: str) -> str:
+    return f"job:{job_id}:logs"
+
+
+def _connect():
+    return redis.Redis.from_url(REDIS_URL, decode_responses=True)
+
+
+class _LineWriter:
+    """File-like object that forwards each printed line to `put`."""
+    def __init__(self, put: Callable[[str], None]):
+        self._put = put
+        self._pending = ''
+        # Pipeline steps print from asyncio.to_thread workers concurrently
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> int:
+        with self._lock:
+            *lines, self._pending = (self._pending + text).split('\n')
+        for line in lines:
+            self._put(line.strip())
+        return len(text)
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending.strip(), ''
+        if pending:
+            self._put(pending)
+
+
+def run_job(job_id: str, pdf_path: str, pages: int) -> None:
+    """
+    RQ task: runs the pipeline for one upload, storing status/results in the job
+    hash and every log line in the job's Redis stream. Workers must share the
+    results directory with the web process.
+    """
+    from pipeline import run_pipeline
+
+    conn = _connect()
+    job_key, log_key = _job_key(job_id), _log_key(job_id)
+
+    def log(line: str) -> None:
+        conn.xadd(log_key, {'line': line})
+
+    conn.hset(job_key, 'status', 'running')
+    log(f"Processing PDF: {os.path.basename(pdf_path)}")
+    # Expire the stream from its first entry so a worker killed mid-job can't
+    # leave it behind; the finally restarts the TTL once the job ends
+    conn.expire(log_key, JOB_TTL)
+
+    writer = _LineWriter(log)
+    try:
+        try:
+            with contextlib.redirect_stdout(writer):
+                outputs = run_pipeline(pdf_path, pages, log=log)
+            writer.flush()
+            result = {
+                'status': 'completed',
+                'narrative': os.path.basename(outputs['narrative']),
+                'sankey': os.path.basename(outputs['sankey'])
+            }
+        except Exception as e:
+            writer.flush()
+            log(f"Error: {e}")
+            result = {'status': 'failed'}
+
+        log('Pipeline complete!')
+        conn.hset(job_key, mapping=result)
+    finally:
+        conn.expire(log_key, JOB_TTL)
+
+
+class RedisJobStore:
+    """Durable job state in Redis with the pipeline work queued on RQ."""
+    def __init__(self, url: str):
+        self.conn = redis.Redis.from_url(url, decode_responses=True)
+        # RQ stores pickled job data, so it needs a connection without decoding
+        self.rq_conn = redis.Redis.from_url(url)
+        self.queue = RQQueue('pipeline', connection=self.rq_conn)
+
+    def enqueue(self, pdf_path: str, pages: int) -> str:
+        job_id = str(uuid.uuid4())
+        job_key = _job_key(job_id)
+        self.conn.hset(job_key, mapping={'status': 'pending', 'pdf_path': pdf_path})
+        self.conn.expire(job_key, JOB_TTL)
+        self.queue.enqueue(
+            run_job, job_id, pdf_path, pages, job_id=job_id, job_timeout=PIPELINE_TIMEOUT
+        )
+        return job_id
+
+    def exists(self, job_id: str) -> bool:
+        return bool(self.conn.exists(_job_key(job_id)))
+
+    def status(self, job_id: str) -> Optional[str]:
+        return self.conn.hget(_job_key(job_id), 'status')
+
+    def result(self, job_id: str) -> Dict[str, str]:
+        data = self.conn.hgetall(_job_key(job_id))
+        return {k: data[k] for k in ('narrative', 'sankey') if k in data}
+
+    def _finished(self, job_id: str) -> bool:
+        """
+        True once no more log lines can arrive: the job hash is gone or final,
+        or RQ no longer runs the job. A job RQ lost or failed (e.g. its worker
+        was killed) without run_job recording a result is marked failed.
+        """
+        if self.status(job_id) in (None, 'completed', 'failed'):
+            return True
+        try:
+            rq_status = RQJob.fetch(job_id, connection=self.rq_conn).get_status()
+        except NoSuchJobError:
+            rq_status = None
+        if rq_status == JobStatus.FINISHED:
+            return True
+        if rq_status in (None, JobStatus.FAILED, JobStatus.STOPPED, JobStatus.CANCELED):
+            # Re-read: run_job may have stored its result since the first check
+            if self.status(job_id) not in ('completed', 'failed'):
+                self.conn.hset(_job_key(job_id), 'status', 'failed')
+            return True
+        return False
+
+    def log_batches(self, job_id: str, block_ms: int = 15000) -> Iterator[List[str]]:
+        """
+        Yield batches of log lines from the start of the job's stream, blocking
+        for new ones; stops once the job can produce no more lines.
+        """
+        log_key, last_id = _log_key(job_id), '0'
+        while True:
+            entries = self.conn.xread({log_key: last_id}, count=500, block=block_ms)
+            if not entries:
+                if self._finished(job_id):
+                    return
+                continue
+            _, messages = entries[0]
+            last_id = messages[-1][0]
+            yield [fields.get('line', '') for _, fields in messages]
@@ -0,0 +1,15 @@
+from grade_narrative import _parse_grade
+
+
+def test_parse_grade_bullets():
+    response = "SCORE: 7/10\nFEEDBACK:\n- Clear revenue story\n  -  Cites margins  \n"
+    assert _parse_grade(response) == (7, ['Clear revenue story', 'Cites margins'])
+
+
+def test_parse_grade_skips_dash_rules():
+    response = "SCORE: 6\nFEEDBACK:\n- a point\n---\n- b\n  ----  \n"
+    assert _parse_grade(response) == (6, ['a point', 'b'])
+
+
+def test_parse_grade_missing_sections():
+    assert _parse_grade("no score here\n- stray bullet") == (0, [])
@@ -1,54 +1,211 @@
 import os
 import json
-import argparse
 from typing import Optional, List, Dict, Tuple, Any
-import math
-from plotly import graph_objects as go
+import functools
+import gzip
+from array import array
+import threading
+from collections import OrderedDict, defaultdict
+import plotly.io as pio
+from pydantic import BaseModel, ConfigDict, TypeAdapter, ValidationError
 
+# orjson parses several times faster; it rejects NaN literals, which the stdlib
+# writer in extract_financials can emit, so those files fall back to json
+try:
+    import orjson
+    HAS_ORJSON = True
+except ImportError:
+    HAS_ORJSON = False
 
-def plot_sankey(
-    json_path: str,
-    output_html: Optional[str] = None,
-    color_scheme: str = "standard"
-) -> str:
+# Link/node palettes selectable with --color-scheme
+COLOR_SCHEMES = {
+    "standard": {
+        "positive": "rgba(44, 160, 44, 0.6)",  # green
+        "negative": "rgba(214, 39, 40, 0.6)",  # red
+        "neutral": "rgba(140, 140, 140, 0.5)",  # gray
+        "revenue": "rgba(31, 119, 180, 0.6)",  # blue
+        "expense": "rgba(255, 127, 14, 0.6)",  # orange
+        "profit": "rgba(44, 160, 44, 0.6)",    # green
+        "tax": "rgba(148, 103, 189, 0.6)"      # purple
+    },
+    "professional": {
+        "positive": "rgba(65, 151, 151, 0.7)",  # teal
+        "negative": "rgba(204, 80, 62, 0.7)",   # rust
+        "neutral": "rgba(120, 120, 120, 0.5)",  # gray
+        "revenue": "rgba(52, 94, 141, 0.7)",    # navy
+        "expense": "rgba(191, 129, 45, 0.7)",   # amber
+        "profit": "rgba(39, 123, 69, 0.7)",     # forest green
+        "tax": "rgba(142, 85, 153, 0.7)"        # violet
+    },
+    "high_contrast": {
+        "positive": "rgba(0, 128, 0, 0.8)",     # bright green
+        "negative": "rgba(220, 20, 60, 0.8)",   # crimson
+        "neutral": "rgba(70, 70, 70, 0.7)",     # dark gray
+        "revenue": "rgba(0, 0, 205, 0.8)",      # medium blue
+        "expense": "rgba(255, 140, 0, 0.8)",    # dark orange
+        "profit": "rgba(50, 205, 50, 0.8)",     # lime green
+        "tax": "rgba(138, 43, 226, 0.8)"        # blue violet
+    }
+}
+
+# Horizontal position levels (left to right financial flow)
+LEVELS = {
+    0.0: ['Products', 'Services'],
+    0.15: ['Revenue'],
+    0.3: ['Cost of Revenue', 'Gross Profit'],
+    0.45: ['Operating Expenses', 'Operating Income'],
+    0.6: ['EBIT', 'Other Income/Expense'],
+    0.75: ['Interest Income', 'Interest Expense', 'EBT'],
+    0.9: ['Taxes', 'Net Income']
+}
+
+# Typed decode for well-formed bucket files; strict so that anything the
+# lenient loader would skip (null names, string values) fails over to it
+class Bucket(BaseModel):
+    model_config = ConfigDict(strict=True)
+
+    bucket: str
+    value: float
+
+
+_BUCKETS_ADAPTER = TypeAdapter(List[Bucket])
+
+# Financial flow connections (source, target, guard) in drawing order; an
+# edge is drawn when both ends exist and its guard holds for the EBIT/EBT
+# nodes present. This is the key part that makes the Sankey diagram
+# represent financial flows correctly.
+CANDIDATE_FLOWS: Tuple[Tuple[str, str, str], ...] = (
+    # Top-level revenue sources
+    ('Products', 'Revenue', 'always'),
+    ('Services', 'Revenue', 'always'),
+    # Revenue allocation
+    ('Revenue', 'Cost of Revenue', 'always'),
+    ('Revenue', 'Gross Profit', 'always'),
+    # Gross profit allocation
+    ('Gross Profit', 'Operating Expenses', 'always'),
+    ('Gross Profit', 'Operating Income', 'always'),
+    # Operating Income flows to EBIT (either directly or through Other Income/Expense)
+    ('Operating Income', 'EBIT', 'always'),
+    ('Other Income/Expense', 'EBIT', 'always'),
+    # If EBIT isn't calculated, connect directly to interest and taxes
+    ('Operating Income', 'Interest Income', 'no_ebit'),
+    ('Operating Income', 'Interest Expense', 'no_ebit'),
+    ('Operating Income', 'Other Income/Expense', 'no_ebit'),
+    # EBIT to EBT with interest components
+    ('EBIT', 'EBT', 'always'),
+    ('Interest Income', 'EBT', 'ebit_ebt'),
+    ('Interest Expense', 'EBT', 'ebit_ebt'),
+    # EBT to Net Income with taxes, or a direct connection if EBT isn't calculated
+    ('EBT', 'Net Income', 'always'),
+    ('Operating Income', 'Net Income', 'no_ebt'),
+    ('Taxes', 'Net Income', 'always'),
+    # Interest straight to Net Income when neither EBIT nor EBT exists
+    ('Interest Income', 'Net Income', 'no_ebit_ebt'),
+    ('Interest Expense', 'Net Income', 'no_ebit_ebt'),
+)
+
+# Color key for every edge plot_sankey can draw; anything else is neutral
+LINK_COLOR_RULE: Dict[Tuple[str, str], str] = {
+    # Revenue generation
+    ('Products', 'Revenue'): 'revenue',
+    ('Services', 'Revenue'): 'revenue',
+    # Cost allocation
+    ('Revenue', 'Cost of Revenue'): 'expense',
+    ('Gross Profit', 'Operating Expenses'): 'expense',
+    # Profit generation
+    ('Revenue', 'Gross Profit'): 'profit',
+    ('Gross Profit', 'Operating Income'): 'profit',
+    ('Operating Income', 'EBIT'): 'profit',
+    ('Other Income/Expense', 'EBIT'): 'profit',
+    ('EBIT', 'EBT'): 'profit',
+    ('Interest Income', 'EBT'): 'profit',
+    ('Interest Expense', 'EBT'): 'profit',
+    # Interest flows
+    ('Operating Income', 'Interest Income'): 'positive',
+    ('Interest Income', 'Net Income'): 'positive',
+    ('Operating Income', 'Interest Expense'): 'negative',
+    ('Interest Expense', 'Net Income'): 'negative',
+    # Tax flows
+    ('Taxes', 'Net Income'): 'tax',
+    # Final income
+    ('EBT', 'Net Income'): 'profit',
+    ('Operating Income', 'Net Income'): 'profit',
+}
+
+# Layout annotation marking derived (calculated) nodes
+FOOTNOTE_ANNOTATION = {
+    "text": "* Calculated values based on reported financials",
+    "showarrow": False,
+    "xref": "paper", "yref": "paper",
+    "x": 0.01, "y": -0.05,
+    "font": {"size": 10, "color": "#666"}
+}
+
+# Rendered output per (json_path, mtime_ns, output_html, color_scheme, compress),
+# with the (mtime_ns, size) the HTML had right after it was written
+SANKEY_MEMO_SIZE = 64
+_SANKEY_MEMO: "OrderedDict[tuple, Tuple[str, Optional[Tuple[int, int]]]]" = OrderedDict()
+_SANKEY_MEMO_LOCK = threading.Lock()
+
+# Bucket groups used to color nodes
+REV_NODES = frozenset({'Products', 'Services', 'Revenue'})
+EXPENSE_NODES = frozenset({'Cost of Revenue', 'Operating Expenses', 'Interest Expense', 'Taxes'})
+PROFIT_NODES = frozenset({'Gross Profit', 'Operating Income', 'EBIT', 'EBT', 'Net Income'})
+
+
+def _loads(raw: bytes) -> Any:
+    if HAS_ORJSON:
+        try:
+            return orjson.loads(raw)
+        except orjson.JSONDecodeError:
+            pass
+    return json.loads(raw)
+
+
+@functools.lru_cache(maxsize=4)
+def _sankey_template(name: str) -> Dict[str, Any]:
     """
-    Reads financial bucket JSON and renders a comprehensive financial Sankey diagram
-    showing the flow of money through the business.
-    
-    Parameters:
-    -----------
-    json_path : str
-        Path to the financial buckets JSON file
-    output_html : Optional[str]
-        Path to save the output HTML file (defaults to input filename + '_sankey.html')
-    color_scheme : str
-        Color scheme to use ('standard', 'professional', 'high_contrast')
-        
-    Returns:
-    --------
-    str : Path to the saved HTML file
+    The named Plotly template without the per-trace defaults for other trace
+    types, which only apply to those types and made up most of the JSON
+    embedded in each page.
     """
+    template = pio.templates[name].to_plotly_json()
+    data = {k: v for k, v in template.get("data", {}).items() if k == "sankey"}
+    return {"data": data, "layout": template.get("layout", {})}
+
+
+def _render_sankey(
+    json_path: str,
+    output_html: Optional[str],
+    color_scheme: str,
+    compress: bool = False
+) -> str:
+    """Builds the Sankey figure for one buckets file and writes it to HTML."""
     # Load buckets
-    with open(json_path, 'r', encoding='utf-8') as f:
-        buckets_raw = json.load(f)
+    with open(json_path, 'rb') as f:
+        raw = f.read()
+    try:
+        items = [(b.bucket, b.value) for b in _BUCKETS_ADAPTER.validate_json(raw)]
+    except ValidationError:
+        # Malformed rows: decode loosely and keep only named numeric values
+        items = [
+            (name, val) for name, val in
+            ((item.get('bucket'), item.get('value')) for item in _loads(raw))
+            if isinstance(name, str) and isinstance(val, (int, float))
+        ]
 
     # Prepare data structures
     bucket_values = {}
     bucket_display = {}
-    valid_items = []
     
-    # Process and validate buckets
-    for item in buckets_raw:
-        name = item.get('bucket')
-        val = item.get('value')
-        if isinstance(name, str) and isinstance(val, (int, float)) and not math.isnan(val):
-            disp = abs(val)  # Use absolute values for display
-            # Avoid zero sizes in visualization
+    for name, val in items:
+        if val == val:  # NaN never equals itself
             bucket_values[name] = val
-            bucket_display[name] = max(disp, 1e-9)  # Minimum size for visibility
-            valid_items.append(name)
+            # Use absolute values for display, with a minimum size for visibility
+            bucket_display[name] = max(abs(val), 1e-9)
     
-    # Create any derived or calculated items needed for the Sankey
+    # Create any derived or calculated items needed for the Sankey; they go
+    # straight into bucket_values so later derivations see them
     derived_items = {}
     
     # Calculate EBIT (Earnings Before Interest and Taxes) if not present
@@ -56,192 +213,72 @@ def plot_sankey(
         ebit_value = bucket_values['Operating Income']
         if 'Other Income/Expense' in bucket_values:
             ebit_value += bucket_values['Other Income/Expense']
-        derived_items['EBIT'] = ebit_value
+        derived_items['EBIT'] = bucket_values['EBIT'] = ebit_value
         bucket_display['EBIT'] = abs(ebit_value) if abs(ebit_value) > 1e-9 else 1e-9
-        valid_items.append('EBIT')
     
     # Calculate EBT (Earnings Before Taxes) if not present
-    if ('EBIT' in bucket_values or 'EBIT' in derived_items) and 'EBT' not in bucket_values:
-        ebit_value = derived_items.get('EBIT', bucket_values.get('EBIT', 0))
-        ebt_value = ebit_value
+    if 'EBIT' in bucket_values and 'EBT' not in bucket_values:
+        ebt_value = bucket_values['EBIT']
         if 'Interest Income' in bucket_values:
             ebt_value += bucket_values['Interest Income']
         if 'Interest Expense' in bucket_values:
             ebt_value -= bucket_values['Interest Expense']
-        derived_items['EBT'] = ebt_value
+        derived_items['EBT'] = bucket_values['EBT'] = ebt_value
         bucket_display['EBT'] = abs(ebt_value) if abs(ebt_value) > 1e-9 else 1e-9
-        valid_items.append('EBT')
-    
-    # Add any calculated items to the bucket values
-    bucket_values.update(derived_items)
     
-    # Define nodes (all unique financial items)
-    nodes = valid_items
+    # Define nodes (all unique financial items, in first-seen order)
+    nodes = list(bucket_values)
     idx = {n: i for i, n in enumerate(nodes)}
     
-    # Define the financial flow connections (source → target)
-    # This is the key part that makes the Sankey diagram represent financial flows correctly
-    flows: List[Tuple[str, str]] = []
-    
-    # Function to add flow if both source and target exist
-    def add_flow(src: str, tgt: str) -> None:
-        if src in idx and tgt in idx:
-            flows.append((src, tgt))
-    
-    # Create complete financial flow structure
-    # Top-level revenue sources
-    add_flow('Products', 'Revenue')
-    add_flow('Services', 'Revenue')
-    
-    # Revenue allocation
-    add_flow('Revenue', 'Cost of Revenue')
-    add_flow('Revenue', 'Gross Profit')
-    
-    # Gross profit allocation
-    add_flow('Gross Profit', 'Operating Expenses')
-    add_flow('Gross Profit', 'Operating Income')
-    
-    # Operating Income flows to EBIT (either directly or through Other Income/Expense)
-    if 'EBIT' in idx:
-        add_flow('Operating Income', 'EBIT')
-        if 'Other Income/Expense' in idx:
-            add_flow('Other Income/Expense', 'EBIT')
-    else:
-        # If EBIT isn't calculated, connect directly to interest and taxes
-        if 'Interest Income' in idx:
-            add_flow('Operating Income', 'Interest Income')
-        if 'Interest Expense' in idx:
-            add_flow('Operating Income', 'Interest Expense')
-        if 'Other Income/Expense' in idx:
-            add_flow('Operating Income', 'Other Income/Expense')
-    
-    # EBIT to EBT with interest components
-    if 'EBIT' in idx and 'EBT' in idx:
-        add_flow('EBIT', 'EBT')
-        if 'Interest Income' in idx:
-            add_flow('Interest Income', 'EBT')
-        if 'Interest Expense' in idx:
-            add_flow('Interest Expense', 'EBT')
-    
-    # EBT to Net Income with taxes
-    if 'EBT' in idx:
-        add_flow('EBT', 'Net Income')
-        if 'Taxes' in idx:
-            add_flow('Taxes', 'Net Income')
-    else:
-        # Direct connection if EBT isn't calculated
-        add_flow('Operating Income', 'Net Income')
-        if 'Taxes' in idx:
-            add_flow('Taxes', 'Net Income')
-    
-    # Add any other connections if needed for completeness
-    if 'Interest Income' in idx and 'Net Income' in idx and ('EBIT' not in idx and 'EBT' not in idx):
-        add_flow('Interest Income', 'Net Income')
-    if 'Interest Expense' in idx and 'Net Income' in idx and ('EBIT' not in idx and 'EBT' not in idx):
-        add_flow('Interest Expense', 'Net Income')
-    
-    # Build link arrays for Plotly
-    link_source, link_target, link_value, link_color = [], [], [], []
-    
-    # Define color schemes
-    color_schemes = {
-        "standard": {
-            "positive": "rgba(44, 160, 44, 0.6)",  # green
-            "negative": "rgba(214, 39, 40, 0.6)",  # red
-            "neutral": "rgba(140, 140, 140, 0.5)",  # gray
-            "revenue": "rgba(31, 119, 180, 0.6)",  # blue
-            "expense": "rgba(255, 127, 14, 0.6)",  # orange
-            "profit": "rgba(44, 160, 44, 0.6)",    # green
-            "tax": "rgba(148, 103, 189, 0.6)"      # purple
-        },
-        "professional": {
-            "positive": "rgba(65, 151, 151, 0.7)",  # teal
-            "negative": "rgba(204, 80, 62, 0.7)",   # rust
-            "neutral": "rgba(120, 120, 120, 0.5)",  # gray
-            "revenue": "rgba(52, 94, 141, 0.7)",    # navy
-            "expense": "rgba(191, 129, 45, 0.7)",   # amber
-            "profit": "rgba(39, 123, 69, 0.7)",     # forest green
-            "tax": "rgba(142, 85, 153, 0.7)"        # violet
-        },
-        "high_contrast": {
-            "positive": "rgba(0, 128, 0, 0.8)",     # bright green
-            "negative": "rgba(220, 20, 60, 0.8)",   # crimson
-            "neutral": "rgba(70, 70, 70, 0.7)",     # dark gray
-            "revenue": "rgba(0, 0, 205, 0.8)",      # medium blue
-            "expense": "rgba(255, 140, 0, 0.8)",    # dark orange
-            "profit": "rgba(50, 205, 50, 0.8)",     # lime green
-            "tax": "rgba(138, 43, 226, 0.8)"        # blue violet
-        }
+    # Keep the candidate flows whose guard holds and whose ends both exist
+    has_ebit, has_ebt = 'EBIT' in idx, 'EBT' in idx
+    guards = {
+        'always': True,
+        'no_ebit': not has_ebit,
+        'ebit_ebt': has_ebit and has_ebt,
+        'no_ebt': not has_ebt,
+        'no_ebit_ebt': not (has_ebit or has_ebt),
     }
+    flows = [(src, tgt) for src, tgt, guard in CANDIDATE_FLOWS
+             if guards[guard] and src in idx and tgt in idx]
     
     # Use the selected color scheme (default to standard if not found)
-    colors = color_schemes.get(color_scheme, color_schemes["standard"])
+    colors = COLOR_SCHEMES.get(color_scheme, COLOR_SCHEMES["standard"])
+    # Resolve the edge rules to this scheme's colors once per figure
+    link_colors = {edge: colors[key] for edge, key in LINK_COLOR_RULE.items()}
+    # Bind each node color once so the node loop appends locals
+    c_rev, c_exp, c_prof, c_pos, c_neg, c_neut = (
+        colors[k] for k in ("revenue", "expense", "profit", "positive", "negative", "neutral")
+    )
     
-    # Process each flow
-    for src, tgt in flows:
+    # Build one (source, target, value, color) row per visible flow in a single pass
+    bd_get, lc_get = bucket_display.get, link_colors.get
+    rows = [
+        (idx[src], idx[tgt], val, lc_get((src, tgt), c_neut))
+        for src, tgt in flows
         # Use absolute value for link thickness
-        val = bucket_display.get(tgt, 0)
-        if val <= 1e-9:
-            continue
-            
-        link_source.append(idx[src])
-        link_target.append(idx[tgt])
-        link_value.append(val)
-        
-        # Determine link color based on financial meaning
-        # Revenue generation
-        if src in ['Products', 'Services'] and tgt == 'Revenue':
-            link_color.append(colors["revenue"])
-        # Cost allocation
-        elif tgt in ['Cost of Revenue', 'Operating Expenses']:
-            link_color.append(colors["expense"])
-        # Profit generation
-        elif tgt in ['Gross Profit', 'Operating Income', 'EBIT', 'EBT']:
-            link_color.append(colors["profit"])
-        # Interest flows
-        elif src == 'Interest Income' or tgt == 'Interest Income':
-            link_color.append(colors["positive"])
-        elif src == 'Interest Expense' or tgt == 'Interest Expense':
-            link_color.append(colors["negative"])
-        # Tax flows
-        elif src == 'Taxes' or tgt == 'Taxes':
-            link_color.append(colors["tax"])
-        # Final income
-        elif tgt == 'Net Income':
-            link_color.append(colors["profit"])
-        # Default
-        else:
-            link_color.append(colors["neutral"])
+        if (val := bd_get(tgt, 0)) > 1e-9
+    ]
+    link_source, link_target, link_value, link_color = (
+        map(list, zip(*rows)) if rows else ([], [], [], [])
+    )
     
     # Node positions - create a logical financial flow layout
-    node_x = [0.0] * len(nodes)
-    node_y = [0.5] * len(nodes)
-    
-    # Define horizontal position levels (left to right financial flow)
-    levels = {
-        0.0: ['Products', 'Services'],
-        0.15: ['Revenue'],
-        0.3: ['Cost of Revenue', 'Gross Profit'],
-        0.45: ['Operating Expenses', 'Operating Income'],
-        0.6: ['EBIT', 'Other Income/Expense'],
-        0.75: ['Interest Income', 'Interest Expense', 'EBT'],
-        0.9: ['Taxes', 'Net Income']
-    }
+    # Packed doubles rather than a PyFloat per slot
+    node_x = array('d', [0.0]) * len(nodes)
+    node_y = array('d', [0.5]) * len(nodes)
     
     # Assign horizontal positions
-    for x, names in levels.items():
+    for x, names in LEVELS.items():
         for name in names:
             if name in idx:
                 node_x[idx[name]] = x
     
     # Calculate vertical positions to prevent overlap
     # Group nodes by their x-position
-    x_groups = {}
+    x_groups = defaultdict(list)
     for name, i in idx.items():
-        x_pos = node_x[i]
-        if x_pos not in x_groups:
-            x_groups[x_pos] = []
-        x_groups[x_pos].append(name)
+        x_groups[node_x[i]].append(name)
     
     # Distribute nodes vertically within each x-position group
     for x_pos, names in x_groups.items():
@@ -254,104 +291,177 @@ def plot_sankey(
                 node_y[idx[name]] = 0.5  # Center if only one node at this x
     
     # Format node labels with financial values in millions
-    node_labels = []
-    for name in nodes:
-        value = bucket_values.get(name, 0)
-        # Format with sign and 1 decimal place
-        sign = "" if value < 0 else "+"
-        if name in derived_items:
-            # Add asterisk to derived values
-            node_labels.append(f"{name}*<br>${sign}{value:.1f}M")
-        else:
-            node_labels.append(f"{name}<br>${sign}{value:.1f}M")
+    # Signed with 1 decimal place; derived values get an asterisk. Every node
+    # is a bucket_values key, so its values line up with nodes.
+    node_values = list(bucket_values.values())
+    derived_nodes = derived_items.keys()
+    suffixes = ['*' if name in derived_nodes else '' for name in nodes]
+    node_labels = [
+        f"{name}{suffix}<br>${'' if value < 0 else '+'}{value:.1f}M"
+        for name, suffix, value in zip(nodes, suffixes, node_values)
+    ]
     
     # Node colors based on financial meaning
     node_color = []
-    for name in nodes:
-        value = bucket_values.get(name, 0)
-        if name in ['Products', 'Services', 'Revenue']:
-            node_color.append(colors["revenue"])
-        elif name in ['Cost of Revenue', 'Operating Expenses', 'Interest Expense', 'Taxes']:
-            node_color.append(colors["expense"])
-        elif name in ['Gross Profit', 'Operating Income', 'EBIT', 'EBT', 'Net Income']:
-            node_color.append(colors["profit"])
+    for name, value in zip(nodes, node_values):
+        if name in REV_NODES:
+            node_color.append(c_rev)
+        elif name in EXPENSE_NODES:
+            node_color.append(c_exp)
+        elif name in PROFIT_NODES:
+            node_color.append(c_prof)
         elif name == 'Interest Income':
-            node_color.append(colors["positive"])
+            node_color.append(c_pos)
         elif name == 'Other Income/Expense':
             # Color based on whether it's positive or negative
             if value >= 0:
-                node_color.append(colors["positive"])
+                node_color.append(c_pos)
             else:
-                node_color.append(colors["negative"])
+                node_color.append(c_neg)
         else:
-            node_color.append(colors["neutral"])
-    
-    # Build Sankey diagram
-    fig = go.Figure(go.Sankey(
-        arrangement='snap',  # 'snap' works better than 'fixed' for financial flows
-        node=dict(
-            label=node_labels,
-            x=node_x,
-            y=node_y,
-            color=node_color,
-            pad=15,        # node padding
-            thickness=20,  # node thickness
-            line=dict(color="black", width=0.5)
-        ),
-        link=dict(
-            source=link_source,
-            target=link_target,
-            value=link_value,
-            color=link_color
-        )
-    ))
+            node_color.append(c_neut)
     
     # Add title and enhance layout
     title = "Financial Flow Analysis"
     # Extract filename for title
     if json_path:
-        base_name = os.path.basename(json_path).split('_')[0]
+        base_name = os.path.basename(json_path).partition('_')[0]
         if base_name:
             title = f"{base_name.capitalize()} - Financial Flow Analysis"
-    
-    # Create footnote for derived values if any exist
-    footnote = ""
-    if derived_items:
-        footnote = "* Calculated values based on reported financials"
-    
-    fig.update_layout(
-        title=dict(
-            text=title,
-            font=dict(size=20, color="#333"),
-            x=0.5,  # centered title
-            y=0.95
-        ),
-        font=dict(family="Arial, sans-serif", size=12, color="#333"),
-        plot_bgcolor='rgba(250,250,250,0.9)',
-        annotations=[
-            dict(
-                text=footnote,
-                showarrow=False,
-                xref="paper", yref="paper",
-                x=0.01, y=-0.05,
-                font=dict(size=10, color="#666")
-            )
-        ] if footnote else []
-    )
-    
+
+    # Build the figure as a plain dict; every value is already a primitive, so
+    # go.Figure's validate/deepcopy pass would only cost time
+    layout = {
+        "title": {
+            "text": title,
+            "font": {"size": 20, "color": "#333"},
+            "x": 0.5,  # centered title
+            "y": 0.95
+        },
+        "font": {"family": "Arial, sans-serif", "size": 12, "color": "#333"},
+        "plot_bgcolor": 'rgba(250,250,250,0.9)',
+        # Footnote for derived values if any exist
+        "annotations": [FOOTNOTE_ANNOTATION] if derived_items else []
+    }
+    # go.Figure applied the default template implicitly; keep the same look
+    if pio.templates.default:
+        layout["template"] = _sankey_template(pio.templates.default)
+
+    fig = {
+        "data": [{
+            "type": "sankey",
+            "arrangement": 'snap',  # 'snap' works better than 'fixed' for financial flows
+            "node": {
+                "label": node_labels,
+                "x": node_x.tolist(),
+                "y": node_y.tolist(),
+                "color": node_color,
+                "pad": 15,        # node padding
+                "thickness": 20,  # node thickness
+                "line": {"color": "black", "width": 0.5}
+            },
+            "link": {
+                "source": link_source,
+                "target": link_target,
+                "value": link_value,
+                "color": link_color
+            }
+        }],
+        "layout": layout
+    }
+
     # Determine output path
     out = output_html or os.path.splitext(json_path)[0] + '_sankey.html'
-    fig.write_html(
-        out,
+    html = pio.to_html(
+        fig,
         include_plotlyjs='cdn',  # Use CDN for smaller file size
         full_html=True,
+        validate=False,
         config={'displayModeBar': True, 'displaylogo': False}
     )
+    if compress:
+        # Level 1 is nearly free and still shrinks the repetitive JSON several times
+        out += '.gz'
+        with gzip.open(out, 'wb', compresslevel=1) as f:
+            f.write(html.encode('utf-8'))
+        return out
+    # One large buffer so the HTML goes out in a single write
+    with open(out, 'w', encoding='utf-8', buffering=1 << 20) as f:
+        f.write(html)
+    
+    return out
+
+
+def _file_signature(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return st.st_mtime_ns, st.st_size
+
+
+def plot_sankey(
+    json_path: str,
+    output_html: Optional[str] = None,
+    color_scheme: str = "standard",
+    compress: bool = False
+) -> str:
+    """
+    Reads financial bucket JSON and renders a comprehensive financial Sankey diagram
+    showing the flow of money through the business.
     
+    Parameters:
+    -----------
+    json_path : str
+        Path to the financial buckets JSON file
+    output_html : Optional[str]
+        Path to save the output HTML file (defaults to input filename + '_sankey.html')
+    color_scheme : str
+        Color scheme to use ('standard', 'professional', 'high_contrast')
+    compress : bool
+        Write gzip-compressed HTML to output path + '.gz'; a web server must
+        serve it with 'Content-Encoding: gzip'
+        
+    Returns:
+    --------
+    str : Path to the saved HTML file
+    """
+    # mtime_ns is part of the key, so a rewritten buckets file renders again
+    key = (json_path, os.stat(json_path).st_mtime_ns, output_html, color_scheme, compress)
+    with _SANKEY_MEMO_LOCK:
+        entry = _SANKEY_MEMO.get(key)
+    # Reuse the earlier render only if its HTML is still the file we wrote;
+    # it may have been deleted or overwritten by another plot since
+    if entry is not None and _file_signature(entry[0]) == entry[1]:
+        return entry[0]
+
+    out = _render_sankey(json_path, output_html, color_scheme, compress)
+    with _SANKEY_MEMO_LOCK:
+        _SANKEY_MEMO[key] = (out, _file_signature(out))
+        _SANKEY_MEMO.move_to_end(key)
+        while len(_SANKEY_MEMO) > SANKEY_MEMO_SIZE:
+            _SANKEY_MEMO.popitem(last=False)
     return out
 
 
+def run(
+    json_path: str,
+    output: Optional[str] = None,
+    color_scheme: str = "professional",
+    compress: bool = False
+) -> str:
+    """CLI behaviour without argparse: render the diagram and report where it went."""
+    html_path = plot_sankey(json_path, output, color_scheme, compress=compress)
+    print(f"✅ Financial Sankey diagram generated successfully")
+    print(f"📊 Output saved to: {html_path}")
+    print(f"📋 Open this file in your browser to view the interactive visualization")
+    return html_path
+
+
 def main():
+    # argparse is only needed when run as a script
+    import argparse
+
     parser = argparse.ArgumentParser(
         description='Generate a professional financial Sankey diagram from extracted financial buckets.'
     )
@@ -359,16 +469,14 @@ def main():
     parser.add_argument('--output', '-o', help='Path to save output HTML file')
     parser.add_argument(
         '--color-scheme', '-c', 
-        choices=['standard', 'professional', 'high_contrast'],
+        choices=list(COLOR_SCHEMES),
         default='professional',
         help='Color scheme to use for the Sankey diagram'
     )
+    parser.add_argument('--gzip', action='store_true', help='Write gzip-compressed HTML (.html.gz)')
     args = parser.parse_args()
 
-    html_path = plot_sankey(args.json, args.output, args.color_scheme)
-    print(f"✅ Financial Sankey diagram generated successfully")
-    print(f"📊 Output saved to: {html_path}")
-    print(f"📋 Open this file in your browser to view the interactive visualization")
+    run(args.json, args.output, args.color_scheme, compress=args.gzip)
 
 if __name__ == '__main__':
     main()
\ No newline at end of file